@@ -13,3 +13,72 @@ ADMINS = env.list('ADMINS')
 RAPID_API_KEY = env.str('RAPID_API_KEY')
 RAPID_API_HOST = env.str('RAPID_API_HOST')
 LOG_FILE = env.str('LOG_FILE')
+TRACE_FILE = env.str('TRACE_FILE', 'traces.jsonl')
+LOG_LEVEL = env.str('LOG_LEVEL', 'DEBUG')
+LOG_LEVEL_SQL = env.str('LOG_LEVEL_SQL', 'WARNING')
+LOG_LEVEL_HTTP = env.str('LOG_LEVEL_HTTP', 'INFO')
+LOG_LEVEL_HANDLERS = env.str('LOG_LEVEL_HANDLERS', 'DEBUG')
+LOG_JSON = env.bool('LOG_JSON', True)
+LOG_SAMPLE_LIMIT = env.int('LOG_SAMPLE_LIMIT', 20)
+LOG_SAMPLE_WINDOW = env.float('LOG_SAMPLE_WINDOW', 10.0)
+PHOTO_WIDTH = env.int('PHOTO_WIDTH', 500)
+PHOTO_CHECK = env.bool('PHOTO_CHECK', True)
+CACHE_LOCATION_SIZE = env.int('CACHE_LOCATION_SIZE', 1000)
+CACHE_LOCATION_TTL = env.int('CACHE_LOCATION_TTL', 24 * 60 * 60)
+CACHE_HOTELS_SIZE = env.int('CACHE_HOTELS_SIZE', 200)
+CACHE_HOTELS_TTL = env.int('CACHE_HOTELS_TTL', 30 * 60)
+WARMUP_TOP_N = env.int('WARMUP_TOP_N', 10)
+WARMUP_API_BUDGET = env.int('WARMUP_API_BUDGET', 20)
+WARMUP_DAYS = env.int('WARMUP_DAYS', 7)
+WARMUP_PAUSE = env.float('WARMUP_PAUSE', 1.0)
+CACHE_TILES_SIZE = env.int('CACHE_TILES_SIZE', 500)
+CACHE_TILES_TTL = env.int('CACHE_TILES_TTL', 30 * 60)
+GEO_TILE_PRECISION = env.int('GEO_TILE_PRECISION', 6)
+BESTDEAL_PRICE_WEIGHT = env.float('BESTDEAL_PRICE_WEIGHT', 0.5)
+BESTDEAL_DISTANCE_WEIGHT = env.float('BESTDEAL_DISTANCE_WEIGHT', 0.5)
+BESTDEAL_MAX_PAGES = env.int('BESTDEAL_MAX_PAGES', 1)
+RETENTION_CALLBACK_DAYS = env.int('RETENTION_CALLBACK_DAYS', 2)
+RETENTION_HOTEL_DAYS = env.int('RETENTION_HOTEL_DAYS', 365)
+RETENTION_REQUEST_DAYS = env.int('RETENTION_REQUEST_DAYS', 365)
+RETENTION_PHOTO_DAYS = env.int('RETENTION_PHOTO_DAYS', 180)
+MAINTENANCE_INTERVAL = env.int('MAINTENANCE_INTERVAL', 24 * 60 * 60)
+MAINTENANCE_BATCH = env.int('MAINTENANCE_BATCH', 500)
+MAINTENANCE_PAUSE = env.float('MAINTENANCE_PAUSE', 0.1)
+CACHE_RENDER_SIZE = env.int('CACHE_RENDER_SIZE', 2000)
+CACHE_RENDER_TTL = env.int('CACHE_RENDER_TTL', 24 * 60 * 60)
+SEND_GLOBAL_RATE = env.float('SEND_GLOBAL_RATE', 25)
+SEND_CHAT_RATE = env.float('SEND_CHAT_RATE', 1)
+SEND_CHAT_BURST = env.float('SEND_CHAT_BURST', 3)
+SEND_RETRY_ATTEMPTS = env.int('SEND_RETRY_ATTEMPTS', 5)
+SEARCH_WORKERS = env.int('SEARCH_WORKERS', 4)
+SEARCH_POLL_INTERVAL = env.float('SEARCH_POLL_INTERVAL', 10.0)
+RETENTION_SEARCH_JOB_DAYS = env.int('RETENTION_SEARCH_JOB_DAYS', 7)
+SEARCH_DEADLINE = env.float('SEARCH_DEADLINE', 90.0)
+CACHE_DETAIL_SIZE = env.int('CACHE_DETAIL_SIZE', 2000)
+CACHE_DETAIL_TTL = env.int('CACHE_DETAIL_TTL', 6 * 60 * 60)
+SNAPSHOT_FILE = env.str('SNAPSHOT_FILE', 'data/snapshot.bin')
+SNAPSHOT_MAX_AGE = env.int('SNAPSHOT_MAX_AGE', 24 * 60 * 60)
+WATCH_INTERVAL = env.int('WATCH_INTERVAL', 6 * 60 * 60)
+WATCH_API_BUDGET = env.int('WATCH_API_BUDGET', 50)
+WATCH_PRICE_DROP = env.float('WATCH_PRICE_DROP', 5.0)
+WATCH_RESULTS_SIZE = env.int('WATCH_RESULTS_SIZE', 10)
+API_MODE = env.str('API_MODE', 'live')
+CASSETTE_DIR = env.str('CASSETTE_DIR', 'data/cassettes')
+API_REPLAY_LATENCY = env.float('API_REPLAY_LATENCY', 0.0)
+API_DAILY_BUDGET = env.int('API_DAILY_BUDGET', 300)
+SEARCH_OVER_BUDGET_WEIGHT = env.float('SEARCH_OVER_BUDGET_WEIGHT', 0.25)
+STATS_DAYS = env.int('STATS_DAYS', 7)
+STATS_TOP_SIZE = env.int('STATS_TOP_SIZE', 5)
+LATENCY_WINDOW = env.int('LATENCY_WINDOW', 1000)
+CACHE_PAGE_SIZE_SIZE = env.int('CACHE_PAGE_SIZE_SIZE', 5000)
+CACHE_PAGE_SIZE_TTL = env.int('CACHE_PAGE_SIZE_TTL', 30 * 24 * 60 * 60)
+PAGE_SIZE_MARGIN = env.float('PAGE_SIZE_MARGIN', 0.25)
+PAGE_SIZE_HISTORY = env.int('PAGE_SIZE_HISTORY', 5)
+CALLBACK_CACHE_SIZE = env.int('CALLBACK_CACHE_SIZE', 10000)
+CALLBACK_TTL = env.int('CALLBACK_TTL', 30)
+PROFILE_SECONDS = env.int('PROFILE_SECONDS', 30)
+PROFILE_MAX_SECONDS = env.int('PROFILE_MAX_SECONDS', 300)
+PROFILE_INTERVAL = env.float('PROFILE_INTERVAL', 0.005)
+PROFILE_TOP_SIZE = env.int('PROFILE_TOP_SIZE', 25)
+GAZETTEER_LETTERS_PER_TYPO = env.int('GAZETTEER_LETTERS_PER_TYPO', 8)
+SEARCH_RETRY_PAUSE = env.float('SEARCH_RETRY_PAUSE', 1.0)
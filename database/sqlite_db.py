@@ -1,8 +1,11 @@
 import sqlite3
-from typing import Any, Union
+from typing import Any, Iterator, List, Optional, Tuple, Union
 
 from loguru import logger
 
+from utils.log_config import is_enabled
+from utils.tracing import span
+
 
 class Database:
     """
@@ -33,20 +36,63 @@ class Database:
         """
         if not parameters:
             parameters = tuple()
-        connection = self.connection
-        connection.set_trace_callback(log)
-        cursor = connection.cursor()
-        data = None
-        cursor.execute(sql_request, parameters)
-        if commit:
-            connection.commit()
-        if fetchone:
-            data = cursor.fetchone()
-        if fetchall:
-            data = cursor.fetchall()
-        connection.close()
+        with span('db.execute', sql=' '.join(sql_request.split())[:60]):
+            connection = self.connection
+            if is_enabled('sql', 'DEBUG'):
+                connection.set_trace_callback(log)
+            cursor = connection.cursor()
+            data = None
+            cursor.execute(sql_request, parameters)
+            if commit:
+                connection.commit()
+            if fetchone:
+                data = cursor.fetchone()
+            if fetchall:
+                data = cursor.fetchall()
+            connection.close()
         return data
 
+    def execute_returning(self, sql_request: str, parameters: tuple = None) -> Optional[tuple]:
+        """
+        Sending a database SQL request which changes the base and returns the first entry (RETURNING clause)
+        :param sql_request: SQL command
+        :param parameters: SQL request parameters
+        """
+        if not parameters:
+            parameters = tuple()
+        with span('db.execute', sql=' '.join(sql_request.split())[:60]):
+            connection = self.connection
+            if is_enabled('sql', 'DEBUG'):
+                connection.set_trace_callback(log)
+            try:
+                data = connection.execute(sql_request, parameters).fetchone()
+                connection.commit()
+            finally:
+                connection.close()
+        return data
+
+    def iterate(self, sql_request: str, parameters: tuple = None, chunk_size: int = 500) -> Iterator[tuple]:
+        """
+        Sending a database SQL request and returning the entries one by one.
+        The entries are read from the cursor by chunks, so the whole result is never loaded into memory.
+        :param sql_request: SQL command
+        :param parameters: SQL request parameters
+        :param chunk_size: the number of entries read at a time
+        """
+        if not parameters:
+            parameters = tuple()
+        connection = self.connection
+        try:
+            cursor = connection.execute(sql_request, parameters)
+            yield tuple(column[0] for column in cursor.description)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            connection.close()
+
     def create_table_users(self) -> None:
         """
         Creating a table Users.
@@ -91,28 +137,67 @@ class Database:
         """
         self.execute(sql_requests, commit=True)
 
-    def create_table_hotel(self) -> None:
+    def create_table_property(self) -> None:
         """
-        Creating a table Hotel.
-        Information about hotels.
+        Creating a table Property.
+        The stable information about hotels: name, address, photos. One entry per hotel.
         """
         sql_requests = """
-        CREATE TABLE IF NOT EXISTS Hotel(
+        CREATE TABLE IF NOT EXISTS Property(
+        hotel_id INTEGER PRIMARY KEY NOT NULL,
+        name VARCHAR(255) NOT NULL,
+        address VARCHAR(255) NOT NULL,
+        photos VARCHAR(255),
+        date_update TIMESTAMP NOT NULL
+        );
+        """
+        self.execute(sql_requests, commit=True)
+
+    def create_table_hotel(self, table: str = 'Hotel') -> None:
+        """
+        Creating a table Hotel.
+        Information about hotels found by a request: price and distance to the center.
+        The Hotel table of an older version of the bot (with name, address, photos) is migrated.
+        """
+        sql_requests = f"""
+        CREATE TABLE IF NOT EXISTS {table}(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id INTEGER NOT NULL,
         request_id INTEGER NOT NULL,
         date_report TIMESTAMP NOT NULL,
         hotel_id INTEGER NOT NULL,
-        name VARCHAR(255) NOT NULL,
-        address VARCHAR(255) NOT NULL,
         center VARCHAR(255) NOT NULL,
         price VARCHAR(255) NOT NULL,
-        photos VARCHAR(255),
         FOREIGN KEY(user_id) REFERENCES Users(id)
         FOREIGN KEY(request_id) REFERENCES UserRequests(id)
+        FOREIGN KEY(hotel_id) REFERENCES Property(hotel_id)
         );
         """
         self.execute(sql_requests, commit=True)
+        if table == 'Hotel':
+            columns = [row[1] for row in self.execute('PRAGMA table_info(Hotel)', fetchall=True)]
+            if 'name' in columns:
+                self.migrate_table_hotel()
+
+    def migrate_table_hotel(self) -> None:
+        """
+        Moving name, address and photos from the Hotel table to the Property table.
+        The latest report of each hotel is used.
+        """
+        logger.info('Migration of the Hotel table')
+        self.create_table_hotel(table='HotelNew')
+        connection = self.connection
+        connection.executescript("""
+        BEGIN;
+        INSERT OR IGNORE INTO Property(hotel_id, name, address, photos, date_update)
+        SELECT hotel_id, name, address, photos, MAX(date_report) FROM Hotel GROUP BY hotel_id;
+        INSERT INTO HotelNew(id, user_id, request_id, date_report, hotel_id, center, price)
+        SELECT id, user_id, request_id, date_report, hotel_id, center, price FROM Hotel;
+        DROP TABLE Hotel;
+        ALTER TABLE HotelNew RENAME TO Hotel;
+        COMMIT;
+        """)
+        connection.close()
 
     def create_table_callback(self) -> None:
         """
@@ -123,7 +208,123 @@ class Database:
         CREATE TABLE IF NOT EXISTS Callback(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         callback_code VARCHAR(255) NOT NULL,
-        area_name VARCHAR(255) NOT NULL
+        area_name VARCHAR(255) NOT NULL,
+        date_create TIMESTAMP
+        );
+        """
+        self.execute(sql_requests, commit=True)
+        self.add_column('Callback', 'date_create', 'TIMESTAMP')
+
+    def add_column(self, table: str, column: str, definition: str) -> None:
+        """
+        Adding a column to the table created by an older version of the bot
+        """
+        columns = [row[1] for row in self.execute(f'PRAGMA table_info({table})', fetchall=True)]
+        if column not in columns:
+            self.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}', commit=True)
+
+    def create_table_photo(self) -> None:
+        """
+        Creating a table Photo.
+        The table contains the photo links and the Telegram file_id of the uploaded photos.
+        """
+        sql_requests = """
+        CREATE TABLE IF NOT EXISTS Photo(
+        url VARCHAR(255) PRIMARY KEY NOT NULL,
+        file_id VARCHAR(255) NOT NULL,
+        date_upload TIMESTAMP NOT NULL
+        );
+        """
+        self.execute(sql_requests, commit=True)
+
+    def create_table_gazetteer(self) -> None:
+        """
+        Creating a table Gazetteer.
+        The table contains the city names entered by users and the areas found for them.
+        """
+        sql_requests = """
+        CREATE TABLE IF NOT EXISTS Gazetteer(
+        name VARCHAR(255) NOT NULL,
+        area_id VARCHAR(255) NOT NULL,
+        area_name VARCHAR(255) NOT NULL,
+        latitude FLOAT,
+        longitude FLOAT,
+        position INTEGER NOT NULL,
+        PRIMARY KEY(name, area_id)
+        );
+        """
+        self.execute(sql_requests, commit=True)
+
+    def create_table_search_job(self) -> None:
+        """
+        Creating a table SearchJob.
+        The queue of hotel searches: the search parameters, the chat and the message showing the progress, the status
+        (queued, running, done, failed, cancelled).
+        """
+        sql_requests = """
+        CREATE TABLE IF NOT EXISTS SearchJob(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        request_id INTEGER,
+        message_id INTEGER,
+        data TEXT NOT NULL,
+        status VARCHAR(20) NOT NULL,
+        date_create TIMESTAMP,
+        date_update TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS SearchJob_status ON SearchJob(status, id);
+        """
+        connection = self.connection
+        connection.executescript(sql_requests)
+        connection.close()
+
+    def create_table_watch(self) -> None:
+        """
+        Creating a table Watch.
+        The saved searches (requests from the UserRequests table) whose prices are watched
+        and the price below which the user is notified.
+        """
+        sql_requests = """
+        CREATE TABLE IF NOT EXISTS Watch(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        request_id INTEGER NOT NULL UNIQUE,
+        price_threshold FLOAT,
+        date_create TIMESTAMP,
+        date_check TIMESTAMP
+        );
+        """
+        self.execute(sql_requests, commit=True)
+
+    def create_table_api_usage(self) -> None:
+        """
+        Creating a table ApiUsage.
+        The number of API calls made for each user per day.
+        """
+        sql_requests = """
+        CREATE TABLE IF NOT EXISTS ApiUsage(
+        user_id INTEGER NOT NULL,
+        day DATE NOT NULL,
+        calls INTEGER NOT NULL,
+        PRIMARY KEY(user_id, day)
+        );
+        """
+        self.execute(sql_requests, commit=True)
+
+    def create_table_stats(self) -> None:
+        """
+        Creating a table Stats.
+        The rollup of the usage by day: the counter of the metric (searches, city, user, active_users, hotels,
+        api_calls) for the key (the search type, the city, the user id or an empty string).
+        """
+        sql_requests = """
+        CREATE TABLE IF NOT EXISTS Stats(
+        day DATE NOT NULL,
+        metric VARCHAR(20) NOT NULL,
+        key VARCHAR(255) NOT NULL,
+        value INTEGER NOT NULL,
+        PRIMARY KEY(metric, day, key)
         );
         """
         self.execute(sql_requests, commit=True)
@@ -151,26 +352,167 @@ class Database:
                       has_photo, amount_photos, check_in, check_out, price_min, price_max, center_min, center_max)
         self.execute('PRAGMA foreign_keys = ON')
         self.execute(sql_request, parameters=parameters, commit=True)
+        self.add_stats(day=str(date_request)[:10],
+                       counters=[('searches', type_search, 1), ('city', area_name, 1), ('user', user_id, 1)])
 
     def add_hotel_report(self, user_id: int, request_id: int, date_report: str, hotel_id: int, name: str,
                          address: str, center: str, price: str, photos: str) -> None:
         """
-        Adding a hotel to the Hotel table
+        Adding a hotel to the Hotel table and the Property table.
+        The Property entry is rewritten only if the name, the address or the photos have changed.
         """
-        sql_request = 'INSERT INTO Hotel(id, user_id, request_id, date_report, hotel_id, name, address, center, ' \
-                      'price, photos) VALUES(NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
-        parameters = (user_id, request_id, date_report, hotel_id, name, address, center, price, photos)
+        sql_request = 'INSERT INTO Property(hotel_id, name, address, photos, date_update) VALUES(?, ?, ?, ?, ?) ' \
+                      'ON CONFLICT(hotel_id) DO UPDATE SET name = excluded.name, address = excluded.address, ' \
+                      'photos = COALESCE(excluded.photos, photos), date_update = excluded.date_update ' \
+                      'WHERE name IS NOT excluded.name OR address IS NOT excluded.address ' \
+                      'OR (excluded.photos IS NOT NULL AND photos IS NOT excluded.photos)'
+        parameters = (hotel_id, name, address, photos, date_report)
+        self.execute(sql_request, parameters=parameters, commit=True)
+        sql_request = 'INSERT INTO Hotel(id, user_id, request_id, date_report, hotel_id, center, price) ' \
+                      'VALUES(NULL, ?, ?, ?, ?, ?, ?)'
+        parameters = (user_id, request_id, date_report, hotel_id, center, price)
         self.execute('PRAGMA foreign_keys = ON')
         self.execute(sql_request, parameters=parameters, commit=True)
+        self.add_stats(day=str(date_report)[:10], counters=[('hotels', '', 1)])
 
-    def add_callback(self, callback_code: str, area_name: str) -> None:
+    def add_callback(self, callback_code: str, area_name: str, date_create: str) -> None:
         """
         Adding a callback information to the Callback table
         """
-        sql_request = 'INSERT INTO Callback(id, callback_code, area_name) VALUES(NULL, ?, ?)'
-        parameters = (callback_code, area_name)
+        sql_request = 'INSERT INTO Callback(id, callback_code, area_name, date_create) VALUES(NULL, ?, ?, ?)'
+        parameters = (callback_code, area_name, date_create)
         self.execute(sql_request, parameters=parameters, commit=True)
 
+    def add_photo(self, url: str, file_id: str, date_upload: str) -> None:
+        """
+        Adding a photo file_id to the Photo table
+        """
+        sql_request = 'INSERT OR REPLACE INTO Photo(url, file_id, date_upload) VALUES(?, ?, ?)'
+        parameters = (url, file_id, date_upload)
+        self.execute(sql_request, parameters=parameters, commit=True)
+
+    def add_gazetteer(self, name: str, area_id: str, area_name: str, latitude: Any, longitude: Any,
+                      position: int) -> None:
+        """
+        Adding an area to the Gazetteer table
+        """
+        sql_request = 'INSERT OR IGNORE INTO Gazetteer(name, area_id, area_name, latitude, longitude, position) ' \
+                      'VALUES(?, ?, ?, ?, ?, ?)'
+        parameters = (name, area_id, area_name, latitude, longitude, position)
+        self.execute(sql_request, parameters=parameters, commit=True)
+
+    def add_search_job(self, user_id: int, chat_id: int, request_id: int, message_id: int, data: str,
+                       date_create: str) -> int:
+        """
+        Adding a search to the SearchJob queue. Returns the job id
+        """
+        sql_request = 'INSERT INTO SearchJob(user_id, chat_id, request_id, message_id, data, status, date_create, ' \
+                      'date_update) VALUES(?, ?, ?, ?, ?, ?, ?, ?) RETURNING id'
+        parameters = (user_id, chat_id, request_id, message_id, data, 'queued', date_create, date_create)
+        return self.execute_returning(sql_request, parameters)[0]
+
+    def claim_search_job(self, job_id: int, date_update: str) -> Optional[tuple]:
+        """
+        Receiving the queued search from the SearchJob table and marking it as running
+        """
+        sql_request = 'UPDATE SearchJob SET status = ?, date_update = ? WHERE id = ? AND status = ? ' \
+                      'RETURNING id, user_id, chat_id, request_id, message_id, data'
+        return self.execute_returning(sql_request, ('running', date_update, job_id, 'queued'))
+
+    def get_queued_searches(self) -> List[tuple]:
+        """
+        Receiving the queued searches (id, user id, parameters) from the SearchJob table in order
+        """
+        sql_request = 'SELECT id, user_id, data FROM SearchJob WHERE status = ? ORDER BY id'
+        return self.execute(sql_request, ('queued',), fetchall=True)
+
+    def update_search_job(self, job_id: int, status: str, date_update: str) -> None:
+        """
+        Changing the status of the search in the SearchJob table
+        """
+        sql_request = 'UPDATE SearchJob SET status = ?, date_update = ? WHERE id = ?'
+        self.execute(sql_request, (status, date_update, job_id), commit=True)
+
+    def requeue_search_jobs(self) -> int:
+        """
+        Returning the searches interrupted by the bot stop to the queue. Returns the number of the searches
+        """
+        sql_request = 'UPDATE SearchJob SET status = ? WHERE status = ? RETURNING id'
+        connection = self.connection
+        amount = len(connection.execute(sql_request, ('queued', 'running')).fetchall())
+        connection.commit()
+        connection.close()
+        return amount
+
+    def cancel_search_jobs(self, chat_id: int, date_update: str) -> int:
+        """
+        Marking the queued searches of the chat as cancelled. Returns the number of the searches
+        """
+        sql_request = 'UPDATE SearchJob SET status = ?, date_update = ? WHERE chat_id = ? AND status = ? RETURNING id'
+        connection = self.connection
+        amount = len(connection.execute(sql_request, ('cancelled', date_update, chat_id, 'queued')).fetchall())
+        connection.commit()
+        connection.close()
+        return amount
+
+    def count_queued_searches(self) -> int:
+        """
+        Receiving the number of searches waiting in the SearchJob queue
+        """
+        sql_request = 'SELECT COUNT(*) FROM SearchJob WHERE status = ?'
+        return self.execute(sql_request, ('queued',), fetchone=True)[0]
+
+    def add_watch(self, user_id: int, request_id: int, price_threshold: Optional[float], date_create: str) -> None:
+        """
+        Adding a saved search to the Watch table
+        """
+        sql_request = 'INSERT OR REPLACE INTO Watch(user_id, request_id, price_threshold, date_create) ' \
+                      'VALUES(?, ?, ?, ?)'
+        parameters = (user_id, request_id, price_threshold, date_create)
+        self.execute(sql_request, parameters=parameters, commit=True)
+
+    def add_api_calls(self, user_id: int, day: str, calls: int) -> None:
+        """
+        Adding API calls of the user to the ApiUsage table
+        """
+        sql_request = 'INSERT INTO ApiUsage(user_id, day, calls) VALUES(?, ?, ?) ' \
+                      'ON CONFLICT(user_id, day) DO UPDATE SET calls = calls + excluded.calls'
+        self.execute(sql_request, (user_id, day, calls), commit=True)
+        self.add_stats(day=day, counters=[('api_calls', '', calls)])
+
+    def get_api_calls(self, user_id: int, day: str) -> int:
+        """
+        Receiving the number of API calls of the user for the day
+        """
+        sql_request = 'SELECT calls FROM ApiUsage WHERE user_id = ? AND day = ?'
+        row = self.execute(sql_request, (user_id, day), fetchone=True)
+        return row[0] if row else 0
+
+    def add_stats(self, day: str, counters: List[Tuple[str, Any, int]]) -> None:
+        """
+        Adding the counters (metric, key, amount) of the day to the Stats table.
+        The first search of a user for the day also increases the active_users counter.
+        """
+        sql_request = 'INSERT INTO Stats(day, metric, key, value) VALUES(?, ?, ?, ?) ' \
+                      'ON CONFLICT(metric, day, key) DO UPDATE SET value = value + excluded.value RETURNING value'
+        with span('db.execute', sql='INSERT INTO Stats'):
+            connection = self.connection
+            try:
+                for metric, key, amount in counters:
+                    value = connection.execute(sql_request, (day, metric, str(key), amount)).fetchone()[0]
+                    if metric == 'user' and value == amount:
+                        connection.execute(sql_request, (day, 'active_users', '', 1)).fetchone()
+                connection.commit()
+            finally:
+                connection.close()
+
+    def update_watch(self, watch_id: int, price_threshold: Optional[float], date_check: str) -> None:
+        """
+        Changing the price threshold and the time of the last check of the saved search
+        """
+        sql_request = 'UPDATE Watch SET price_threshold = ?, date_check = ? WHERE id = ?'
+        self.execute(sql_request, (price_threshold, date_check, watch_id), commit=True)
+
     @staticmethod
     def format_args(sql_request, parameters: dict) -> Union[str, tuple]:
         """
@@ -189,9 +531,11 @@ class Database:
 
     def get_report_hotel(self, **kwargs) -> None:
         """
-        Receiving hotels information from the Hotel table
+        Receiving hotels information from the Hotel and Property tables
         """
-        sql_request = 'SELECT * FROM Hotel WHERE '
+        sql_request = 'SELECT Hotel.id, user_id, request_id, date_report, Hotel.hotel_id, name, address, center, ' \
+                      'price, photos FROM Hotel JOIN Property ON Property.hotel_id = Hotel.hotel_id WHERE '
+        kwargs = {f'Hotel.{key}': value for key, value in kwargs.items()}
         sql_request, parameters = self.format_args(sql_request, kwargs)
         return self.execute(sql_request, parameters, fetchall=True)
 
@@ -203,6 +547,57 @@ class Database:
         sql_request, parameters = self.format_args(sql_request, kwargs)
         return self.execute(sql_request, parameters, fetchone=True)
 
+    def get_photos(self, urls: List[str]) -> List[Tuple[str, str]]:
+        """
+        Receiving the photo links and their file_id from the Photo table
+        """
+        sql_request = f'SELECT url, file_id FROM Photo WHERE url IN ({", ".join("?" * len(urls))})'
+        return self.execute(sql_request, tuple(urls), fetchall=True)
+
+    def get_gazetteer(self) -> List[tuple]:
+        """
+        Receiving all areas from the Gazetteer table
+        """
+        sql_request = 'SELECT name, area_id, area_name, latitude, longitude FROM Gazetteer ORDER BY name, position'
+        return self.execute(sql_request, fetchall=True)
+
+    def get_watch(self, **kwargs) -> Optional[tuple]:
+        """
+        Receiving a saved search from the Watch table
+        """
+        sql_request = 'SELECT * FROM Watch WHERE '
+        sql_request, parameters = self.format_args(sql_request, kwargs)
+        return self.execute(sql_request, parameters, fetchone=True)
+
+    def get_active_watches(self, check_in_from: str, checked_before: str) -> List[tuple]:
+        """
+        Receiving the saved searches with the parameters of their requests whose check-in date has not passed
+        and which have not been checked since checked_before. The searches checked long ago go first.
+        """
+        sql_request = 'SELECT Watch.id, Watch.user_id, Watch.request_id, Watch.price_threshold, ' \
+                      'UserRequests.type_search, UserRequests.area_id, UserRequests.area_name, ' \
+                      'UserRequests.latitude, UserRequests.longitude, UserRequests.check_in, UserRequests.check_out, ' \
+                      'UserRequests.price_min, UserRequests.price_max, UserRequests.center_min, ' \
+                      'UserRequests.center_max FROM Watch JOIN UserRequests ON UserRequests.id = Watch.request_id ' \
+                      'WHERE UserRequests.check_in >= ? AND (Watch.date_check IS NULL OR Watch.date_check < ?) ' \
+                      'ORDER BY Watch.date_check IS NOT NULL, Watch.date_check'
+        return self.execute(sql_request, (check_in_from, checked_before), fetchall=True)
+
+    def get_next_watch_check(self, check_in_from: str) -> Optional[str]:
+        """
+        Receiving the time of the earliest last check of the saved searches whose check-in date has not passed
+        """
+        sql_request = 'SELECT MIN(Watch.date_check) FROM Watch ' \
+                      'JOIN UserRequests ON UserRequests.id = Watch.request_id WHERE UserRequests.check_in >= ?'
+        return self.execute(sql_request, (check_in_from,), fetchone=True)[0]
+
+    def get_min_price(self, request_id: int) -> Optional[float]:
+        """
+        Receiving the lowest price of the hotels found by the request
+        """
+        sql_request = 'SELECT MIN(CAST(price AS REAL)) FROM Hotel WHERE request_id = ?'
+        return self.execute(sql_request, (request_id,), fetchone=True)[0]
+
     def get_requests(self, **kwargs):
         """
         Receiving requests information from the UserRequests table
@@ -211,6 +606,63 @@ class Database:
         sql_request, parameters = self.format_args(sql_request, kwargs)
         return self.execute(sql_request, parameters, fetchall=True)
 
+    def get_popular_cities(self, date_from: str, limit: int) -> List[Tuple[str, int]]:
+        """
+        Receiving the most frequently searched cities since date_from from the UserRequests table
+        """
+        sql_request = 'SELECT city, COUNT(*) AS amount FROM UserRequests ' \
+                      'WHERE date_request >= ? AND city IS NOT NULL ' \
+                      'GROUP BY LOWER(city) ORDER BY amount DESC LIMIT ?'
+        return self.execute(sql_request, (date_from, limit), fetchall=True)
+
+    def get_popular_searches(self, date_from: str, check_in_from: str, limit: int) -> List[tuple]:
+        """
+        Receiving the most frequent area searches and date windows since date_from from the UserRequests table.
+        Only the searches with the check-in date not earlier than check_in_from.
+        """
+        sql_request = 'SELECT type_search, area_id, amount_hotels, check_in, check_out, price_min, price_max, ' \
+                      'center_max, COUNT(*) AS amount FROM UserRequests ' \
+                      'WHERE date_request >= ? AND check_in >= ? AND area_id IS NOT NULL ' \
+                      'GROUP BY type_search, area_id, amount_hotels, check_in, check_out, price_min, price_max, ' \
+                      'center_max ORDER BY amount DESC LIMIT ?'
+        return self.execute(sql_request, (date_from, check_in_from, limit), fetchall=True)
+
+    def iterate_history(self, user_id: int) -> Iterator[tuple]:
+        """
+        Receiving requests of the user with their hotels from the UserRequests and Hotel tables one by one.
+        The first entry is the column names. The photos are given only for the requests with photos.
+        """
+        sql_request = 'SELECT UserRequests.id AS request_id, date_request, type_search, city, area_name, ' \
+                      'latitude, longitude, amount_hotels, has_photo, amount_photos, check_in, check_out, ' \
+                      'price_min, price_max, center_min, center_max, Hotel.hotel_id, name, address, center, price, ' \
+                      "CASE WHEN has_photo = 'Yes' THEN photos END AS photos " \
+                      'FROM UserRequests LEFT JOIN Hotel ON Hotel.request_id = UserRequests.id ' \
+                      'LEFT JOIN Property ON Property.hotel_id = Hotel.hotel_id ' \
+                      'WHERE UserRequests.user_id = ? ORDER BY UserRequests.id, Hotel.id'
+        return self.iterate(sql_request, (user_id,))
+
+    def get_stats_total(self, metric: str, date_from: str) -> int:
+        """
+        Receiving the sum of the metric counters from the Stats table since the date
+        """
+        sql_request = 'SELECT SUM(value) FROM Stats WHERE metric = ? AND day >= ?'
+        return self.execute(sql_request, (metric, date_from), fetchone=True)[0] or 0
+
+    def get_stats_top(self, metric: str, date_from: str, limit: int) -> List[Tuple[str, int]]:
+        """
+        Receiving the keys of the metric with the largest sums from the Stats table since the date
+        """
+        sql_request = 'SELECT key, SUM(value) AS total FROM Stats WHERE metric = ? AND day >= ? ' \
+                      'GROUP BY key ORDER BY total DESC LIMIT ?'
+        return self.execute(sql_request, (metric, date_from, limit), fetchall=True)
+
+    def count_stats_keys(self, metric: str, date_from: str) -> int:
+        """
+        Receiving the number of different keys of the metric in the Stats table since the date
+        """
+        sql_request = 'SELECT COUNT(DISTINCT key) FROM Stats WHERE metric = ? AND day >= ?'
+        return self.execute(sql_request, (metric, date_from), fetchone=True)[0]
+
     def delete_hotels(self, **kwargs):
         """
         Removing information about hotels from the Hotel table
@@ -219,6 +671,21 @@ class Database:
         sql_request, parameters = self.format_args(sql_request, kwargs)
         return self.execute(sql_request, parameters, commit=True)
 
+    def delete_watch(self, **kwargs) -> None:
+        """
+        Removing a saved search from the Watch table
+        """
+        sql_request = 'DELETE FROM Watch WHERE '
+        sql_request, parameters = self.format_args(sql_request, kwargs)
+        self.execute(sql_request, parameters, commit=True)
+
+    def delete_photos(self, urls: List[str]) -> None:
+        """
+        Removing photos from the Photo table
+        """
+        sql_request = f'DELETE FROM Photo WHERE url IN ({", ".join("?" * len(urls))})'
+        self.execute(sql_request, tuple(urls), commit=True)
+
     def delete_request(self, **kwargs):
         """
         Removing information about requests from the UserRequests table
@@ -227,7 +694,51 @@ class Database:
         sql_request, parameters = self.format_args(sql_request, kwargs)
         return self.execute(sql_request, parameters, commit=True)
 
+    def delete_expired(self, table: str, condition: str, parameters: tuple, batch_size: int) -> int:
+        """
+        Removing one batch of entries matching the condition from the table. Returns the number of removed entries
+        """
+        sql_request = f'SELECT rowid FROM {table} WHERE {condition} LIMIT ?'
+        rows = self.execute(sql_request, parameters + (batch_size,), fetchall=True)
+        if rows:
+            sql_request = f'DELETE FROM {table} WHERE rowid IN ({", ".join("?" * len(rows))})'
+            self.execute(sql_request, tuple(row[0] for row in rows), commit=True)
+        return len(rows)
+
+    def get_size(self) -> Tuple[int, int]:
+        """
+        Returns the size of the database file and the size of its free pages (bytes)
+        """
+        page_size = self.execute('PRAGMA page_size', fetchone=True)[0]
+        page_count = self.execute('PRAGMA page_count', fetchone=True)[0]
+        freelist_count = self.execute('PRAGMA freelist_count', fetchone=True)[0]
+        return page_count * page_size, freelist_count * page_size
+
+    def enable_incremental_vacuum(self) -> None:
+        """
+        Switching the database to the incremental auto vacuum mode by a full VACUUM (once, the database is locked
+        for the whole VACUUM, so it is done at the bot start before the workers and polling)
+        """
+        with span('db.vacuum'):
+            connection = self.connection
+            if connection.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                logger.info('Switching the database to the incremental auto vacuum')
+                connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                connection.execute('VACUUM')
+            connection.close()
+
+    def compact(self) -> None:
+        """
+        Returning free pages to the file system and updating the statistics of the query planner
+        """
+        with span('db.compact'):
+            connection = self.connection
+            connection.execute('PRAGMA incremental_vacuum').fetchall()
+            connection.execute('ANALYZE')
+            connection.commit()
+            connection.close()
+
 
 def log(statement):
     """ Logging SQL requests """
-    logger.info(statement)
+    logger.debug(statement)
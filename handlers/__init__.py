@@ -4,3 +4,4 @@ from . import help # noqa
 from . import echo # noqa
 from . import hotel_search # noqa
 from . import history # noqa
+from . import admin # noqa
@@ -0,0 +1,107 @@
+import asyncio
+import datetime
+
+from aiogram import types, Dispatcher
+from aiogram.utils.markdown import quote_html
+from loguru import logger
+
+from data import config
+from keyboards.kb_inline import get_kb_inline_delete
+from loader import db
+from utils.cache import caches
+from utils.profiling import profiling, send_profile
+from utils.tracing import last_traces, get_breakdown, get_percentiles
+
+
+async def show_trace(message: types.Message) -> None:
+    """
+    The answer to the admin when a command is 'trace'.
+    Shows the time breakdown of the last search of the user: '/trace user_id' (by default the admin himself).
+    """
+    logger.info(f'Start trace command, admin {message.from_user.id}')
+    args = message.get_args().strip()
+    if args and not args.isdigit():
+        await message.answer('⛔ Использование: /trace id_пользователя')
+        return
+    user_id = int(args) if args else message.from_user.id
+    last_trace = last_traces.get(user_id)
+    if last_trace is None:
+        await message.answer(f'Нет данных о поиске пользователя {user_id}', reply_markup=get_kb_inline_delete())
+        return
+    await message.answer(f'<pre>{quote_html(get_breakdown(last_trace))}</pre>', parse_mode='HTML',
+                         reply_markup=get_kb_inline_delete())
+
+
+def get_stats_report(days: int) -> str:
+    """
+    Returns the text report on the usage for the last days: from the Stats rollup table,
+    the cache statistics and the latencies of the last searches and calls
+    """
+    today = datetime.date.today()
+    date_from = str(today - datetime.timedelta(days=days - 1))
+    lines = [f'Статистика за {days} дн. (с {date_from})', '']
+    lines.append(f'поисков: {db.get_stats_total("searches", date_from)}')
+    for type_search, amount in db.get_stats_top('searches', date_from, limit=10):
+        lines.append(f'  {amount:>6}  {type_search}')
+    lines.append(f'отелей в отчётах: {db.get_stats_total("hotels", date_from)}')
+    lines.append(f'активных пользователей: {db.count_stats_keys("user", date_from)} '
+                 f'(сегодня {db.get_stats_total("active_users", str(today))})')
+    lines.append(f'запросов к API: {db.get_stats_total("api_calls", date_from)} '
+                 f'(сегодня {db.get_stats_total("api_calls", str(today))})')
+    lines.extend(['', 'популярные города:'])
+    for city, amount in db.get_stats_top('city', date_from, limit=config.STATS_TOP_SIZE):
+        lines.append(f'  {amount:>6}  {city}')
+    lines.extend(['', 'кэши:'])
+    for cache in caches:
+        requests = cache.hits + cache.misses
+        hit_rate = f'{cache.hits / requests:.0%}' if requests else '-'
+        lines.append(f'  {cache.name:<9} {hit_rate:>5} из {requests}')
+    lines.extend(['', 'задержки, мс (p50 / p90 / p99):'])
+    for name in ('search', 'api', 'db', 'bot'):
+        percentiles = get_percentiles(name)
+        if percentiles is not None:
+            lines.append(f'  {name:<6} ' + ' / '.join(f'{duration * 1000:.0f}' for duration in percentiles))
+    return '\n'.join(lines)
+
+
+async def show_stats(message: types.Message) -> None:
+    """
+    The answer to the admin when a command is 'stats'.
+    Shows the usage statistics: '/stats days' (by default config.STATS_DAYS).
+    """
+    logger.info(f'Start stats command, admin {message.from_user.id}')
+    args = message.get_args().strip()
+    if args and (not args.isdigit() or int(args) == 0):
+        await message.answer('⛔ Использование: /stats количество_дней')
+        return
+    days = int(args) if args else config.STATS_DAYS
+    await message.answer(f'<pre>{quote_html(get_stats_report(days))}</pre>', parse_mode='HTML',
+                         reply_markup=get_kb_inline_delete())
+
+
+async def start_profile(message: types.Message) -> None:
+    """
+    The answer to the admin when a command is 'profile'.
+    Starts profiling for '/profile seconds' (by default config.PROFILE_SECONDS), the reports come as documents.
+    """
+    logger.info(f'Start profile command, admin {message.from_user.id}')
+    args = message.get_args().strip()
+    if args and (not args.isdigit() or not 0 < int(args) <= config.PROFILE_MAX_SECONDS):
+        await message.answer(f'⛔ Использование: /profile количество_секунд (до {config.PROFILE_MAX_SECONDS})')
+        return
+    if profiling.locked():
+        await message.answer('Профилирование уже запущено', reply_markup=get_kb_inline_delete())
+        return
+    seconds = int(args) if args else config.PROFILE_SECONDS
+    asyncio.create_task(send_profile(seconds))
+    await message.answer(f'Профилирование на {seconds} с запущено, отчёт придёт документом',
+                         reply_markup=get_kb_inline_delete())
+
+
+def register_admin_handlers(dp: Dispatcher) -> None:
+    """
+    Admin handlers registration. The commands are available only to the users from config.ADMINS
+    """
+    dp.register_message_handler(show_trace, commands=['trace'], user_id=config.ADMINS, state='*')
+    dp.register_message_handler(show_stats, commands=['stats'], user_id=config.ADMINS, state='*')
+    dp.register_message_handler(start_profile, commands=['profile'], user_id=config.ADMINS, state='*')
@@ -21,7 +21,9 @@ async def get_help(message: types.Message) -> None:
 
 /mycity ищет отели в вашем городе по цене и расположению от центра
 
-/history показывает историю ваших запросов
+/history показывает историю ваших запросов, там же можно включить слежение за ценой
+
+/export присылает историю запросов файлом (/export csv или /export jsonl)
 
 /hello_world здоровается с пользователем
 
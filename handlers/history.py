@@ -1,11 +1,23 @@
+import asyncio
+import datetime
+from contextlib import suppress
+
 from aiogram import types, Dispatcher
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters import Text
+from aiogram.types import InputFile
+from aiogram.utils.exceptions import MessageNotModified
 from loguru import logger
 
-from keyboards.kb_inline import history_action, get_kb_inline_delete, get_kb_inline_requests_list
+from data import config
+from keyboards.kb_inline import history_action, get_kb_inline_delete, get_kb_inline_requests, \
+    get_kb_inline_requests_list
 from loader import db
 from states.states import History
+from utils.history_export import EXPORT_FORMATS, write_history
+from utils.idempotency import idempotent
+from utils.messages import edit_or_resend
+from utils.render import render_request_info, invalidate_request_info
 
 
 async def enter_history(message: types.Message, state: FSMContext) -> None:
@@ -31,14 +43,17 @@ async def pagination(callback: types.CallbackQuery, state: FSMContext) -> None:
     Inline keyboard update when paginating a user request list
     """
     if callback.data == 'next_step':
-        await callback.message.delete()
-        await get_kb_inline_requests_list(callback.message, state, page_shift=1, user_id=callback.message.chat.id)
+        await edit_or_resend(callback.message, 'История запросов:',
+                             reply_markup=await get_kb_inline_requests(state, page_shift=1,
+                                                                       user_id=callback.message.chat.id))
     elif callback.data == 'back_step':
-        await callback.message.delete()
-        await get_kb_inline_requests_list(callback.message, state, page_shift=-1, user_id=callback.message.chat.id)
+        await edit_or_resend(callback.message, 'История запросов:',
+                             reply_markup=await get_kb_inline_requests(state, page_shift=-1,
+                                                                       user_id=callback.message.chat.id))
     elif callback.data == 'to_requests':
-        await callback.message.delete()
-        await get_kb_inline_requests_list(callback.message, state, page_shift=0, user_id=callback.message.chat.id)
+        await edit_or_resend(callback.message, 'История запросов:',
+                             reply_markup=await get_kb_inline_requests(state, page_shift=0,
+                                                                       user_id=callback.message.chat.id))
     elif callback.data == 'finish':
         logger.info(f'Finish viewing the history of requests, user {callback.message.from_user.id}')
         await callback.message.delete()
@@ -46,34 +61,23 @@ async def pagination(callback: types.CallbackQuery, state: FSMContext) -> None:
         await state.finish()
 
 
+@idempotent('⏳ Уже выполняется')
 async def get_request_info(callback: types.CallbackQuery) -> None:
     """
     The answer to the user (hotels information) when a callback is "request_{id_request}" and state is "step".
     """
     request_id = callback.data.split('_')[1]
-    hotels_list = db.get_report_hotel(request_id=request_id)
-    if hotels_list:
-        text = ''
-        for hotel in hotels_list:
-            name = hotel[5]
-            address = hotel[6]
-            center = round(float(hotel[7]) * 1.6)
-            price = round(float(hotel[8]))
-            link = f'https://www.hotels.com/h{hotel[4]}.Hotel-Information'
-            hotel_info = f'🏨 <b>{name}</b>\n' \
-                         f'📍 <b>Адрес:</b>  {address}\n' \
-                         f'📏 <b>Расстояние до центра:</b>  {center} км\n' \
-                         f'💲 <b>Цена за ночь:</b>  {price} $\n' \
-                         f'🔗 <b>Ссылка:</b>  {link}\n\n\n'
-            text += hotel_info
-        await callback.message.delete()
-        await callback.message.answer(text, parse_mode='HTML', reply_markup=history_action(request_id=request_id))
+    text = render_request_info(request_id)
+    watched = db.get_watch(request_id=request_id) is not None
+    if text:
+        await edit_or_resend(callback.message, text, parse_mode='HTML',
+                             reply_markup=history_action(request_id=request_id, watched=watched))
     else:
-        await callback.message.delete()
-        await callback.message.answer(text='Это пустой запрос. Здесь нет отелей',
-                                      reply_markup=history_action(request_id=request_id))
+        await edit_or_resend(callback.message, 'Это пустой запрос. Здесь нет отелей',
+                             reply_markup=history_action(request_id=request_id, watched=watched))
 
 
+@idempotent('⏳ Уже выполняется')
 async def delete_hotels(callback: types.CallbackQuery, state: FSMContext) -> None:
     """
     Removing hotels from the Hotel table and removing requests from the UserRequests when a callback is 'delreq_'
@@ -81,17 +85,65 @@ async def delete_hotels(callback: types.CallbackQuery, state: FSMContext) -> Non
     """
     request_id = callback.data.split('_')[1]
     db.delete_hotels(request_id=request_id)
+    db.delete_watch(request_id=request_id)
     db.delete_request(id=request_id)
+    invalidate_request_info(request_id)
     await callback.answer('Отели и запрос удалены из истории')
-    await callback.message.delete()
-    await get_kb_inline_requests_list(callback.message, state, page_shift=0, user_id=callback.message.chat.id)
+    await edit_or_resend(callback.message, 'История запросов:',
+                         reply_markup=await get_kb_inline_requests(state, page_shift=0,
+                                                                   user_id=callback.message.chat.id))
+
+
+@idempotent('⏳ Уже выполняется')
+async def watch_request(callback: types.CallbackQuery) -> None:
+    """
+    Switching the price watch of the request when a callback is 'watch_' and state is 'step'.
+    The user is notified when the price falls config.WATCH_PRICE_DROP percent below the lowest price found.
+    """
+    request_id = callback.data.split('_')[1]
+    if db.get_watch(request_id=request_id) is not None:
+        db.delete_watch(request_id=request_id)
+        logger.info(f'Price watch of request {request_id} is removed')
+        await callback.answer('Слежение за ценой выключено')
+    else:
+        price = db.get_min_price(request_id=request_id)
+        threshold = price * (1 - config.WATCH_PRICE_DROP / 100) if price else None
+        db.add_watch(user_id=callback.from_user.id, request_id=request_id, price_threshold=threshold,
+                     date_create=datetime.datetime.now())
+        logger.info(f'Price watch of request {request_id} is added, threshold {threshold}')
+        await callback.answer('Слежение за ценой включено. Я напишу, когда цена снизится')
+    with suppress(MessageNotModified):
+        await callback.message.edit_reply_markup(
+            history_action(request_id=request_id, watched=db.get_watch(request_id=request_id) is not None))
+
+
+async def export_history(message: types.Message) -> None:
+    """
+    The answer to the user when a command is 'export'.
+    Sends the history of requests with hotels as a file: '/export csv' (by default) or '/export jsonl'.
+    """
+    file_format = message.get_args().strip().lower() or 'csv'
+    if file_format not in EXPORT_FORMATS:
+        await message.answer('⛔ Использование: /export csv или /export jsonl', reply_markup=get_kb_inline_delete())
+        return
+    logger.info(f'Start export of the history of requests, user {message.from_user.id}, format {file_format}')
+    file, amount = await asyncio.to_thread(write_history, message.from_user.id, file_format)
+    with file:
+        if amount == 0:
+            await message.answer('<b>История запросов пуста!</b>\nМожно что-нибудь поискать:\n\n/lowprice\n\n/bestdeal',
+                                 parse_mode='HTML', reply_markup=get_kb_inline_delete())
+        else:
+            await message.answer_document(InputFile(file, filename=f'history.{file_format}'),
+                                          caption=f'История запросов: {amount} записей')
 
 
 def register_get_history(dp: Dispatcher) -> None:
     """
-    Enter_history, get_request_info, delete_hotels, pagination handlers registration
+    Enter_history, export_history, get_request_info, delete_hotels, watch_request, pagination handlers registration
     """
     dp.register_message_handler(enter_history, text='/history')
+    dp.register_message_handler(export_history, commands=['export'])
     dp.register_callback_query_handler(get_request_info, Text(startswith='request_'), state=History.step)
     dp.register_callback_query_handler(delete_hotels, Text(startswith='delreq_'), state=History.step)
+    dp.register_callback_query_handler(watch_request, Text(startswith='watch_'), state=History.step)
     dp.register_callback_query_handler(pagination, state=History.step)
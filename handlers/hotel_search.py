@@ -6,7 +6,6 @@ from contextlib import suppress
 from aiogram import types, Dispatcher
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters import Text
-from aiogram.types import MediaGroup
 from aiogram.utils.exceptions import MessageCantBeDeleted, MessageToDeleteNotFound
 from aiogram_calendar_rus import simple_cal_callback, SimpleCalendar
 from loguru import logger
@@ -16,8 +15,12 @@ from keyboards.kb_inline import get_kb_inline_hotels_list, get_kb_inline_back_ho
 from keyboards.kb_reply import get_kb_geolocation
 from loader import db, bot
 from states.states import SearchHotels, History
-from utils.rapidapi.get_cities import get_areas
-from utils.rapidapi.get_hotels import get_hotels_list
+from utils.gazetteer import find_areas
+from utils.idempotency import idempotent
+from utils.messages import edit_or_resend
+from utils.photo_cache import send_album
+from utils.render import render_hotel_card
+from utils.search_queue import search_queue
 
 
 async def reset_state(message: types.Message) -> None:
@@ -50,7 +53,9 @@ async def process_callback_delete(callback_query: types.CallbackQuery) -> None:
 async def stop(callback: types.CallbackQuery, state: FSMContext) -> None:
     """
     Cancel hotel search, close state machine when a callback is 'stop'.
+    The queued and running searches of the chat are cancelled.
     """
+    search_queue.cancel(callback.message.chat.id)
     await callback.message.answer('Вы отменили поиск отелей 🙅\nМожет всё же что-нибудь поищем?'
                                   '\n\n/lowprice\n\n/bestdeal\n\n/mycity',
                                   reply_markup=kb_inline.get_kb_inline_delete())
@@ -61,8 +66,9 @@ async def stop(callback: types.CallbackQuery, state: FSMContext) -> None:
 async def geolocation_start(message: types.Message, state: FSMContext) -> None:
     """
     The answer to the user when a command is 'mycity'.
-    Setting a state 'geolocation'.
+    Setting a state 'geolocation'. The previous searches of the chat are cancelled.
     """
+    search_queue.cancel(message.chat.id)
     await SearchHotels.command.set()
     async with state.proxy() as data:
         logger.info('Start mycity command')
@@ -104,8 +110,9 @@ async def finish_geolocation(message: types.Message, state: FSMContext) -> None:
 async def city_start(message: types.Message, state: FSMContext) -> None:
     """
     The answer to the user when a command is 'lowprice' or 'bestdeal'.
-    Setting a state 'city'.
+    Setting a state 'city'. The previous searches of the chat are cancelled.
     """
+    search_queue.cancel(message.chat.id)
     await SearchHotels.command.set()
     async with state.proxy() as data:
         if message.text == '/lowprice':
@@ -132,7 +139,7 @@ async def enter_city_name(message: types.Message, state: FSMContext) -> None:
     async with state.proxy() as data:
         data['city'] = message.text.strip()
     city = data.get('city')
-    areas_list = get_areas(city)
+    areas_list = find_areas(city)
     if areas_list:
         await message.answer('Пожалуйста, уточните место: ', reply_markup=kb_inline.get_kb_inline_area(areas_list))
         await message.delete()
@@ -148,11 +155,20 @@ async def enter_city_name(message: types.Message, state: FSMContext) -> None:
 async def enter_area_name(callback: types.CallbackQuery, state: FSMContext) -> None:
     """
     The answer to the user when a state is 'city' and callback is 'area_'
-    Setting a state 'amount_hotels'.
+    Setting a state 'amount_hotels' (or 'city' again if the list of areas has expired).
     """
     area_id = callback.data.split('_')[1]
     callback_code = callback.data.split('_')[2]
-    area_name = db.get_callback(callback_code=callback_code)[0]
+    callback_info = db.get_callback(callback_code=callback_code)
+    if callback_info is None:
+        logger.info(f'Callback {callback_code} is expired')
+        with suppress(MessageCantBeDeleted, MessageToDeleteNotFound):
+            await callback.message.delete()
+        await callback.message.answer('Этот список мест устарел. Введите название города ещё раз',
+                                      reply_markup=kb_inline.get_kb_inline_delete_stop())
+        await SearchHotels.city.set()
+        return
+    area_name = callback_info[0]
     async with state.proxy() as data:
         data['area_id'] = area_id
         data['area_name'] = area_name
@@ -344,11 +360,11 @@ async def enter_center_max(message: types.Message, state: FSMContext) -> None:
         await SearchHotels.search.set()
 
 
+@idempotent('⏳ Поиск уже запущен, подождите')
 async def start_searching(callback: types.CallbackQuery, state: FSMContext) -> None:
     """
-    The answer to the user when a state is 'search' and callback is 'search'
-    Setting a state 'page'.
-    When hotels are not found close state machine
+    The answer to the user when a state is 'search' and callback is 'search'.
+    Saving the request and putting the search into the queue, the hotels are shown by the search queue worker.
     """
     async with state.proxy() as data:
         user_id = callback.from_user.id
@@ -369,10 +385,12 @@ async def start_searching(callback: types.CallbackQuery, state: FSMContext) -> N
         center_min = data.get('center_min', 'нет')
         center_max = data.get('center_max', 'нет')
 
-    db.add_user_request(user_id=user_id, date_request=date_request, type_search=type_search, city=city, area_id=area_id,
-                        area_name=area_name, latitude=latitude, longitude=longitude, amount_hotels=amount_hotels,
-                        has_photo=has_photo, amount_photos=amount_photos, check_in=check_in, check_out=check_out,
-                        price_min=price_min, price_max=price_max, center_min=center_min, center_max=center_max)
+    db.add_user_request(user_id=user_id, date_request=date_request, type_search=type_search, city=city,
+                        area_id=area_id, area_name=area_name, latitude=latitude, longitude=longitude,
+                        amount_hotels=amount_hotels, has_photo=has_photo, amount_photos=amount_photos,
+                        check_in=check_in, check_out=check_out, price_min=price_min, price_max=price_max,
+                        center_min=center_min, center_max=center_max)
+    request_id = db.get_request_id(date_request=date_request)[0]
 
     request = f'✅ Ок!\n' \
               f'<b>Тип поиска</b>: {type_search}\n' \
@@ -388,48 +406,31 @@ async def start_searching(callback: types.CallbackQuery, state: FSMContext) -> N
 
     await callback.message.delete()
     await callback.message.answer(request, parse_mode='HTML')
-    await callback.message.answer(text='Пожалуйста, подождите! Ищу варианты ...', parse_mode='HTML',
-                                  reply_markup=kb_inline.get_kb_inline_delete())
-    hotels_list = get_hotels_list(data)
-    logger.info('Ready list of hotels')
-    if len(hotels_list) != 0:
-        async with state.proxy() as data:
-            data['hotels_list'] = hotels_list
-            data['page'] = 0
-        for hotel in hotels_list:
-            request_id = db.get_request_id(date_request=data['time_request'])[0]
-            db.add_hotel_report(user_id=callback.from_user.id, request_id=request_id,
-                                date_report=datetime.datetime.now(), hotel_id=hotel.hotel_id, name=hotel.name,
-                                address=hotel.address, center=hotel.center, price=hotel.price,
-                                photos=hotel.photos)
-        await callback.message.answer(text='Варианты отелей:',
-                                      reply_markup=await get_kb_inline_hotels_list(state=state, page_shift=0))
+    queued = db.count_queued_searches()
+    if queued:
+        text = f'Пожалуйста, подождите! Поиск поставлен в очередь, перед вами: {queued}'
     else:
-        await callback.message.answer(text='К сожалению ничего не могу найти для вас 😞\n'
-                                           'Можно попробовать ещё раз, изменив критерии поиска!'
-                                           '\n\n/lowprice\n\n/bestdeal\n\n/mycity',
-                                      reply_markup=kb_inline.get_kb_inline_delete())
-        logger.info('Hotels are not found')
-        await state.finish()
+        text = 'Пожалуйста, подождите! Ищу варианты ...'
+    message = await callback.message.answer(text=text, reply_markup=kb_inline.get_kb_inline_delete())
+    search_queue.enqueue(user_id=user_id, chat_id=callback.message.chat.id, request_id=request_id,
+                         message_id=message.message_id, data=data)
 
 
+@idempotent('⏳ Уже выполняется')
 async def pagination(callback: types.CallbackQuery, state: FSMContext) -> None:
     """
     Inline keyboard update when paginating a hotel list
     """
 
     if callback.data == 'next':
-        await callback.message.delete()
-        await callback.message.answer(text='Варианты отелей',
-                                      reply_markup=await get_kb_inline_hotels_list(state=state, page_shift=1))
+        await edit_or_resend(callback.message, text='Варианты отелей',
+                             reply_markup=await get_kb_inline_hotels_list(state=state, page_shift=1))
     elif callback.data == 'back':
-        await callback.message.delete()
-        await callback.message.answer(text='Варианты отелей',
-                                      reply_markup=await get_kb_inline_hotels_list(state=state, page_shift=-1))
+        await edit_or_resend(callback.message, text='Варианты отелей',
+                             reply_markup=await get_kb_inline_hotels_list(state=state, page_shift=-1))
     elif callback.data == 'to_hotels':
-        await callback.message.delete()
-        await callback.message.answer(text='Варианты отелей',
-                                      reply_markup=await get_kb_inline_hotels_list(state=state, page_shift=0))
+        await edit_or_resend(callback.message, text='Варианты отелей',
+                             reply_markup=await get_kb_inline_hotels_list(state=state, page_shift=0))
 
     elif callback.data.split('_')[0] == 'hotel':
         async with state.proxy() as data:
@@ -437,33 +438,31 @@ async def pagination(callback: types.CallbackQuery, state: FSMContext) -> None:
         hotel_id = callback.data.split('_')[1]
         hotel_info = ''
         short_info = ''
-        album = MediaGroup()
+        photos_list = []
         for i_hotel in hotels_list:
             if i_hotel.hotel_id == hotel_id:
                 amount_nights = (data["check_out"] - data["check_in"]).days
-                hotel_info = f'🏨 <b>{i_hotel.name}</b>\n📍 <b>Адрес:</b>  {i_hotel.address}\n' \
-                             f'📏 <b>Расстояние до центра:</b>  {round(i_hotel.center * 1.6)} км\n' \
-                             f'💲 <b>Цена за ночь:</b>  {round(i_hotel.price)} $' \
-                             f'\n💰 <b>Cтоимость за {amount_nights} ноч.:' \
-                             f'</b>  {round(amount_nights * i_hotel.price)} $\n' \
-                             f'🔗 <b>Ссылка:</b>  https://www.hotels.com/h{hotel_id}.Hotel-Information'
+                hotel_info = render_hotel_card(i_hotel, amount_nights)
 
                 if i_hotel.photos is not None:
                     short_info = f'<b>{i_hotel.name}</b>, {round(i_hotel.price)} $ за ночь'
                     photos_list = i_hotel.photos.split(', ')
-                    for photo in photos_list:
-                        album.attach_photo(photo=photo)
                 break
 
         if short_info != '':
             await callback.message.answer(text=short_info, parse_mode='HTML')
-            await callback.message.answer_media_group(media=album)
-
-        await callback.message.delete()
-        await callback.message.answer(text=hotel_info, parse_mode='HTML',
-                                      reply_markup=get_kb_inline_back_hotels_list())
+            await send_album(callback.message, photos_list)
+            await callback.message.delete()
+            await callback.message.answer(text=hotel_info, parse_mode='HTML',
+                                          reply_markup=get_kb_inline_back_hotels_list())
+        else:
+            await edit_or_resend(callback.message, text=hotel_info, parse_mode='HTML',
+                                 reply_markup=get_kb_inline_back_hotels_list())
 
     elif callback.data == 'stop':
+        if search_queue.cancel(callback.message.chat.id):
+            await stop(callback, state)
+            return
         await callback.message.delete()
         await callback.message.answer('Вы закрыли список предложенных вариантов.\nМожно поискать еще!\n\n/lowprice'
                                       '\n\n/bestdeal\n\n/mycity\n\nИстория запросов:\n\n/history',
@@ -500,6 +499,6 @@ def register_handlers(dp: Dispatcher) -> None:
                                                     SearchHotels.amount_photos, SearchHotels.date_check_in,
                                                     SearchHotels.date_check_out, SearchHotels.search,
                                                     SearchHotels.page, History.step])
-    dp.register_callback_query_handler(pagination, state=SearchHotels.search)
     dp.register_callback_query_handler(process_callback_delete, text='delete', state='*')
+    dp.register_callback_query_handler(pagination, state=SearchHotels.search)
     dp.register_callback_query_handler(stop, text='stop', state='*')
@@ -1,6 +1,7 @@
 import math
 import uuid
 from datetime import datetime
+from functools import lru_cache
 from typing import List
 
 from aiogram import types
@@ -20,12 +21,13 @@ def get_kb_inline_area(areas_list: List[City]) -> InlineKeyboardMarkup:
         area_id = area.city_id
         name_area = area.name
         uid = str(uuid.uuid1())
-        db.add_callback(callback_code=uid, area_name=name_area)
+        db.add_callback(callback_code=uid, area_name=name_area, date_create=datetime.now())
         button = InlineKeyboardButton(text=f'{name_area}', callback_data=f'area_{area_id}_{uid}')
         keyboard.add(button)
     return keyboard
 
 
+@lru_cache(maxsize=None)
 def get_kb_inline_numbers(row_num: int, col_num: int) -> InlineKeyboardMarkup:
     """
     Returns inline keyboard where the number of rows is row_num and the number of columns is col_num.
@@ -40,6 +42,7 @@ def get_kb_inline_numbers(row_num: int, col_num: int) -> InlineKeyboardMarkup:
     return keyboard
 
 
+@lru_cache(maxsize=None)
 def get_answer_YorN() -> InlineKeyboardMarkup:
     """
     Returns inline keyboard with numbers answers Yes or No
@@ -51,6 +54,7 @@ def get_answer_YorN() -> InlineKeyboardMarkup:
     return keyboard
 
 
+@lru_cache(maxsize=None)
 def get_kb_inline_delete() -> InlineKeyboardMarkup:
     """
     Returns inline keyboard for remove answer bot
@@ -61,6 +65,7 @@ def get_kb_inline_delete() -> InlineKeyboardMarkup:
     return keyboard
 
 
+@lru_cache(maxsize=None)
 def get_kb_inline_delete_stop() -> InlineKeyboardMarkup:
     """
     Returns the inline keyboard to delete the bot response or stop the search
@@ -72,6 +77,7 @@ def get_kb_inline_delete_stop() -> InlineKeyboardMarkup:
     return keyboard
 
 
+@lru_cache(maxsize=None)
 def get_kb_inline_start() -> InlineKeyboardMarkup:
     """
     Returns the inline keyboard to start the search
@@ -133,7 +139,7 @@ async def get_kb_inline_hotels_list(state: FSMContext, page_shift: int) -> Inlin
     return keyboard
 
 
-async def get_kb_inline_requests_list(message: types.Message, state: FSMContext, page_shift: int, user_id: int) -> None:
+async def get_kb_inline_requests(state: FSMContext, page_shift: int, user_id: int) -> InlineKeyboardMarkup:
     """
     Formation of an inline keyboard when paginating a user request list
     """
@@ -162,9 +168,17 @@ async def get_kb_inline_requests_list(message: types.Message, state: FSMContext,
     back = InlineKeyboardButton(text='Назад', callback_data='back_step')
     stop = InlineKeyboardButton(text='Закончить просмотр запросов', callback_data='finish')
     keyboard.row(back, pages, nex).add(stop)
-    await message.answer('История запросов:', reply_markup=keyboard)
+    return keyboard
+
+
+async def get_kb_inline_requests_list(message: types.Message, state: FSMContext, page_shift: int, user_id: int) -> None:
+    """
+    Sending a new message with the page of the user request list
+    """
+    await message.answer('История запросов:', reply_markup=await get_kb_inline_requests(state, page_shift, user_id))
 
 
+@lru_cache(maxsize=None)
 def get_kb_inline_back_hotels_list() -> InlineKeyboardMarkup:
     """
     Returns the inline keyboard to navigate back to the list of found hotels
@@ -175,12 +189,17 @@ def get_kb_inline_back_hotels_list() -> InlineKeyboardMarkup:
     return keyboard
 
 
-def history_action(request_id: str) -> InlineKeyboardMarkup:
+def history_action(request_id: str, watched: bool = False) -> InlineKeyboardMarkup:
     """
-    Returns the inline keyboard to remove the request or navigate back to the list of requests
+    Returns the inline keyboard to remove the request, switch the price watch of the request
+    or navigate back to the list of requests
     """
     keyboard = InlineKeyboardMarkup()
     b1 = InlineKeyboardButton(text='Удалить этот запрос', callback_data=f'delreq_{request_id}')
     b2 = InlineKeyboardButton(text='Вернуться к списку запросов', callback_data='to_requests')
-    keyboard.row(b1, b2)
+    if watched:
+        b3 = InlineKeyboardButton(text='🔕 Не следить за ценой', callback_data=f'watch_{request_id}')
+    else:
+        b3 = InlineKeyboardButton(text='🔔 Следить за ценой', callback_data=f'watch_{request_id}')
+    keyboard.row(b1, b2).add(b3)
     return keyboard
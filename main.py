@@ -6,16 +6,16 @@ from aiogram import Dispatcher
 import handlers
 from data import config
 from loader import bot, dp, db
+from utils.log_config import setup_logging
+from utils.maintenance import run_maintenance
 from utils.notify_admins import on_starting_notify
+from utils.search_queue import search_queue
 from utils.set_bot_commands import set_bot_commands
+from utils.snapshot import restore_snapshot, save_snapshot
+from utils.warmup import warm_up_caches
+from utils.watches import run_watches
 
-logger.add(
-    config.LOG_FILE,
-    format="{time} {level} {message}",
-    level="DEBUG",
-    rotation="1 week",
-    compression="zip",
-)
+setup_logging()
 
 
 def register_all_handlers(dispatcher: Dispatcher):
@@ -27,6 +27,7 @@ def register_all_handlers(dispatcher: Dispatcher):
     handlers.help.register_get_help(dispatcher)
     handlers.hotel_search.register_handlers(dispatcher)
     handlers.history.register_get_history(dispatcher)
+    handlers.admin.register_admin_handlers(dispatcher)
     handlers.echo.register_bot_echo(dispatcher)
 
 
@@ -35,13 +36,21 @@ async def main():
     """
     Bot start:
     - calling the handler registration function;
-    - creating Users, UserRequests, Hotel, Callback tables in the database if they are not already created;
+    - creating Users, UserRequests, Property, Hotel, Callback, Photo, Gazetteer, SearchJob, Watch, ApiUsage,
+      Stats tables in the database if they are not already created (the old Hotel table is migrated);
+    - switching the database to the incremental auto vacuum (a full VACUUM once, before the workers start);
+    - restoring the FSM storage and the caches from the snapshot of the previous run;
     - sending a message to the administrator that the bot is running;
     - prohibition of sending replies to those user messages that were sent at the time the bot was offline;
+    - cache warmup with the most frequent searches in the background;
+    - database maintenance (retention and compaction) in the background;
+    - starting the search queue workers (the interrupted searches are resumed);
+    - checking the price watches of the saved searches in the background;
     - polling the Telegram server for updates;
     - command menu setup.
 
     Bot finish:
+    - saving the FSM storage and the caches to the snapshot;
     - sends a message to the administrator about the bot stop;
     - closing session.
     """
@@ -49,20 +58,38 @@ async def main():
     register_all_handlers(dp)
     db.create_table_users()
     db.create_table_user_requests()
+    db.create_table_property()
     db.create_table_hotel()
     db.create_table_callback()
+    db.create_table_photo()
+    db.create_table_gazetteer()
+    db.create_table_search_job()
+    db.create_table_watch()
+    db.create_table_api_usage()
+    db.create_table_stats()
+    db.enable_incremental_vacuum()
+    restore_snapshot(config.SNAPSHOT_FILE)
 
     try:
         logger.info('Бот запущен')
         await on_starting_notify(dp, 'Бот запущен')
         await dp.skip_updates()
+        asyncio.create_task(warm_up_caches())
+        asyncio.create_task(run_maintenance())
+        search_queue.start()
+        asyncio.create_task(run_watches())
         await dp.start_polling()
         await set_bot_commands(dp)
     finally:
-        await on_starting_notify(dp, 'Бот остановлен')
+        save_snapshot(config.SNAPSHOT_FILE)
+        try:
+            await on_starting_notify(dp, 'Бот остановлен')
+        except Exception as err:
+            logger.error(f'The stop notice is not sent: {err}')
         await dp.storage.close()
         await dp.storage.wait_closed()
         await (await bot.get_session()).close()
+        await logger.complete()
 
 if __name__ == '__main__':
     try:
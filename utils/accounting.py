@@ -0,0 +1,70 @@
+import contextvars
+import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram import types
+from loguru import logger
+
+from data import config
+from loader import db
+
+"""
+Per-user accounting of the API calls. The user of a call is taken from the context: the search worker sets api_user,
+in the handlers it is the author of the update. The calls are added to the ApiUsage table by day. A search which does
+not fit into the rest of the daily budget config.API_DAILY_BUDGET is degraded (no photos, fewer hotels) instead
+of being refused.
+"""
+
+api_user: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar('api_user', default=None)
+
+
+def get_api_user() -> Optional[int]:
+    """
+    Returns the id of the user the API calls are made for
+    """
+    user_id = api_user.get()
+    if user_id is None:
+        user = types.User.get_current()
+        if user is not None:
+            user_id = user.id
+    return user_id
+
+
+def count_api_call() -> None:
+    """
+    Adds the API call to the daily calls of the current user
+    """
+    user_id = get_api_user()
+    if user_id is not None:
+        db.add_api_calls(user_id=user_id, day=str(datetime.date.today()), calls=1)
+
+
+def estimate_api_calls(data: Dict[str, Any]) -> int:
+    """
+    Returns the expected number of API calls of the search: the hotel list pages and one detail call per hotel
+    """
+    pages = 1 if data.get('command') == 'самые дешёвые' else config.BESTDEAL_MAX_PAGES
+    return pages + int(data.get('amount_hotels') or 0)
+
+
+def get_remaining_budget(user_id: int) -> Optional[int]:
+    """
+    Returns the number of API calls left for the user today (None if there is no budget)
+    """
+    if config.API_DAILY_BUDGET <= 0:
+        return None
+    return config.API_DAILY_BUDGET - db.get_api_calls(user_id=user_id, day=str(datetime.date.today()))
+
+
+def apply_budget(user_id: int, data: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+    """
+    Returns the search parameters fitting into the rest of the daily budget of the user:
+    without photos and with fewer hotels (at least one). The flag shows if the search was degraded.
+    """
+    remaining = get_remaining_budget(user_id)
+    if remaining is None or estimate_api_calls(data) <= remaining:
+        return data, False
+    amount_hotels = max(1, min(int(data.get('amount_hotels') or 1),
+                               remaining - estimate_api_calls({**data, 'amount_hotels': 0})))
+    logger.info(f'API budget of user {user_id}: {remaining} calls left, {amount_hotels} hotels without photos')
+    return {**data, 'has_photo': 'No', 'amount_photos': 0, 'amount_hotels': amount_hotels}, True
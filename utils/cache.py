@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Optional, Tuple
+
+from data import config
+
+
+class TTLCache:
+    """
+    In-memory LRU cache whose entries expire after ttl seconds.
+    Is thread-safe: API requests are also made from worker threads.
+    Args:
+        name (str): the cache name for logs and statistics
+        maxsize (int): the maximum number of entries
+        ttl (float): the lifetime of an entry in seconds
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._loader: Optional[Callable[[], List[Tuple[Hashable, float, Any]]]] = None
+
+    def _restore(self) -> None:
+        """
+        Loads the deferred entries (see defer) on the first use of the cache. Is called under the lock
+        """
+        if self._loader is None:
+            return
+        loader, self._loader = self._loader, None
+        now = time.time()
+        for key, expires, value in reversed(loader()):
+            if expires >= now and key not in self._data:
+                self._data[key] = (expires, value)
+                self._data.move_to_end(key, last=False)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        """
+        Returns the value of the key or default if the key is missing or expired
+        """
+        with self._lock:
+            self._restore()
+            item = self._data.get(key)
+            if item is None or item[0] < time.time():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Saves the value of the key. The least recently used entry is removed if the cache is full
+        """
+        with self._lock:
+            self._restore()
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """
+        Removes the key from the cache
+        """
+        with self._lock:
+            self._restore()
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Removes all entries
+        """
+        with self._lock:
+            self._loader = None
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            self._restore()
+            item = self._data.get(key)
+            return item is not None and item[0] >= time.time()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._restore()
+            return len(self._data)
+
+    def dump(self) -> List[Tuple[Hashable, float, Any]]:
+        """
+        Returns the entries which have not expired (key, expiry time, value) from the least to the most recently used
+        """
+        with self._lock:
+            self._restore()
+            now = time.time()
+            return [(key, expires, value) for key, (expires, value) in self._data.items() if expires >= now]
+
+    def defer(self, loader: Callable[[], List[Tuple[Hashable, float, Any]]]) -> None:
+        """
+        Sets the function returning the saved entries (as returned by dump). The entries are loaded on the first use
+        of the cache, the entries saved since the start are kept.
+        """
+        with self._lock:
+            self._loader = loader
+
+
+location_cache = TTLCache('location', maxsize=config.CACHE_LOCATION_SIZE, ttl=config.CACHE_LOCATION_TTL)
+hotels_cache = TTLCache('hotels', maxsize=config.CACHE_HOTELS_SIZE, ttl=config.CACHE_HOTELS_TTL)
+tile_cache = TTLCache('tile', maxsize=config.CACHE_TILES_SIZE, ttl=config.CACHE_TILES_TTL)
+cards_cache = TTLCache('cards', maxsize=config.CACHE_RENDER_SIZE, ttl=config.CACHE_RENDER_TTL)
+history_cache = TTLCache('history', maxsize=config.CACHE_RENDER_SIZE, ttl=config.CACHE_RENDER_TTL)
+detail_cache = TTLCache('detail', maxsize=config.CACHE_DETAIL_SIZE, ttl=config.CACHE_DETAIL_TTL)
+page_size_cache = TTLCache('pages', maxsize=config.CACHE_PAGE_SIZE_SIZE, ttl=config.CACHE_PAGE_SIZE_TTL)
+callback_cache = TTLCache('taps', maxsize=config.CALLBACK_CACHE_SIZE, ttl=config.CALLBACK_TTL)
+
+caches = [location_cache, hotels_cache, tile_cache, cards_cache, history_cache, detail_cache, page_size_cache,
+          callback_cache]
@@ -0,0 +1,125 @@
+import asyncio
+import contextvars
+import threading
+import time
+from typing import Any, Callable, Optional
+
+import requests
+
+"""
+Cancellation and deadline of a search. The token of the running search is kept in a context variable, so it reaches
+the API requests made in the worker threads of the search. Every request checks the token, uses the HTTP session
+of the token (closed on cancel) and a timeout no longer than the time left before the deadline. The enrichment loop
+stops at the deadline and returns the hotels found so far.
+"""
+
+
+class SearchCancelled(Exception):
+    """
+    The search was cancelled by the user
+    """
+
+
+class CancelToken:
+    """
+    Cancellation flag, deadline and HTTP session of one search
+    Args:
+        timeout (float): seconds until the deadline
+    """
+
+    def __init__(self, timeout: float):
+        self.deadline = time.monotonic() + timeout
+        self.event = threading.Event()
+        self.session = requests.Session()
+        self.task: Optional[asyncio.Future] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def remaining(self) -> float:
+        """
+        Returns the number of seconds left before the deadline
+        """
+        return self.deadline - time.monotonic()
+
+    def expired(self) -> bool:
+        """
+        Checks if the deadline has passed
+        """
+        return self.remaining() <= 0
+
+    def check(self) -> None:
+        """
+        Raises SearchCancelled if the search was cancelled
+        """
+        if self.event.is_set():
+            raise SearchCancelled
+
+    def cancel(self) -> None:
+        """
+        Cancels the search: the next API request of the search fails, the idle connections of the session are closed
+        and the coroutine waiting for the search is released at once
+        """
+        if self.event.is_set():
+            return
+        self.event.set()
+        self.session.close()
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        """
+        Runs the function in a worker thread with the token as the current one.
+        Raises SearchCancelled as soon as the token is cancelled.
+        """
+        reset_token = current_token.set(self)
+        try:
+            self.task = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        finally:
+            current_token.reset(reset_token)
+        try:
+            return await self.task
+        except asyncio.CancelledError:
+            if self.cancelled:
+                raise SearchCancelled
+            raise
+        finally:
+            self.session.close()
+
+
+current_token: contextvars.ContextVar[Optional[CancelToken]] = contextvars.ContextVar('current_token', default=None)
+
+
+def get_session() -> Any:
+    """
+    Returns the HTTP session of the current search (the requests module outside a search).
+    Raises SearchCancelled if the search was cancelled.
+    """
+    token = current_token.get()
+    if token is None:
+        return requests
+    token.check()
+    return token.session
+
+
+def get_timeout(timeout: float) -> float:
+    """
+    Returns the request timeout: no longer than the time left before the deadline of the current search
+    (but at least one second)
+    """
+    token = current_token.get()
+    if token is None:
+        return timeout
+    return max(min(timeout, token.remaining()), 1.0)
+
+
+def deadline_passed() -> bool:
+    """
+    Checks if the deadline of the current search has passed. Raises SearchCancelled if the search was cancelled.
+    """
+    token = current_token.get()
+    if token is None:
+        return False
+    token.check()
+    return token.expired()
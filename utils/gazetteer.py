@@ -0,0 +1,211 @@
+import re
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from data import config
+from loader import db
+from utils.rapidapi.get_cities import City, get_areas
+
+"""
+Local gazetteer of the areas found by locations/v3/search. The areas are stored in the Gazetteer table by the city
+name which the user typed. The names are indexed by a trie (prefix search) and by trigrams (search with typos),
+so a repeated city or a city with a clear typo is found without an API request. A prefix completion or
+an ambiguous typo is only a suggestion used when the API does not know the name.
+"""
+
+
+def normalize(text: str) -> str:
+    """
+    Returns the city name in lower case without punctuation and extra spaces
+    """
+    text = text.lower().replace('ё', 'е')
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return ' '.join(text.split())
+
+
+def get_trigrams(text: str) -> Set[str]:
+    """
+    Returns the set of trigrams of the text padded with spaces
+    """
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def levenshtein(first: str, second: str, limit: int) -> int:
+    """
+    Returns the edit distance between the strings or limit + 1 if it is greater than limit
+    """
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i]
+        for j, second_char in enumerate(second, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (first_char != second_char)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class Gazetteer:
+    """
+    Index of city names with the areas found for them
+    Args:
+        min_prefix (int): the minimum length of the text for the prefix search
+    """
+
+    def __init__(self, min_prefix: int = 4):
+        self.min_prefix = min_prefix
+        self.areas: Dict[str, List[City]] = {}
+        self.trie: Dict = {}
+        self.trigrams: Dict[str, Set[str]] = {}
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        """
+        Loads the areas from the Gazetteer table
+        """
+        for name, area_id, area_name, latitude, longitude in db.get_gazetteer():
+            self._index(name, City(city_id=area_id, name=area_name, latitude=latitude, longitude=longitude))
+        self.loaded = True
+        logger.info(f'Gazetteer loaded: {len(self.areas)} names')
+
+    def _index(self, name: str, area: City) -> None:
+        """
+        Adds the area to the index by the name
+        """
+        if name not in self.areas:
+            self.areas[name] = []
+            node = self.trie
+            for char in name:
+                node = node.setdefault(char, {})
+            node[''] = name
+            for trigram in get_trigrams(name):
+                self.trigrams.setdefault(trigram, set()).add(name)
+        if area.city_id not in (i_area.city_id for i_area in self.areas[name]):
+            self.areas[name].append(area)
+
+    def add(self, city: str, areas: List[City]) -> None:
+        """
+        Saves the areas found by the API for the city name
+        """
+        name = normalize(city)
+        if not name or not areas:
+            return
+        with self._lock:
+            if not self.loaded:
+                self.load()
+            if name in self.areas:
+                return
+            for position, area in enumerate(areas):
+                self._index(name, area)
+                db.add_gazetteer(name=name, area_id=area.city_id, area_name=area.name, latitude=area.latitude,
+                                 longitude=area.longitude, position=position)
+
+    def complete(self, prefix: str) -> List[str]:
+        """
+        Returns the names starting with prefix
+        """
+        node = self.trie
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        names = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for char, child in node.items():
+                if char == '':
+                    names.append(child)
+                else:
+                    stack.append(child)
+        return names
+
+    def nearest(self, name: str) -> List[Tuple[int, str]]:
+        """
+        Returns the names within 1-2 typos of the name (by the length of the name) with their edit distances,
+        from the nearest
+        """
+        limit = 0 if len(name) <= 4 else 1 if len(name) <= 8 else 2
+        if limit == 0:
+            return []
+        candidates: Dict[str, int] = {}
+        for trigram in get_trigrams(name):
+            for candidate in self.trigrams.get(trigram, ()):
+                candidates[candidate] = candidates.get(candidate, 0) + 1
+        best = sorted(candidates, key=candidates.get, reverse=True)[:20]
+        distances = sorted((levenshtein(name, candidate, limit), candidate) for candidate in best)
+        return [item for item in distances if item[0] <= limit]
+
+    def match(self, name: str) -> Optional[str]:
+        """
+        Returns the name if the similarity is confident: the same name or the nearest name with no more than
+        one typo per config.GAZETTEER_LETTERS_PER_TYPO letters, at least 2 edits closer than any other name.
+        A completion of the prefix is never confident (see suggest).
+        """
+        if name in self.areas:
+            return name
+        distances = self.nearest(name)
+        if not distances:
+            return None
+        distance, candidate = distances[0]
+        if distance * config.GAZETTEER_LETTERS_PER_TYPO > len(name):
+            return None
+        if len(distances) > 1 and distances[1][0] < distance + 2:
+            return None
+        return candidate
+
+    def suggest(self, name: str) -> Optional[str]:
+        """
+        Returns the probable name for a city unknown to the API: a single completion of a long enough unfinished
+        word or the nearest name within 1-2 typos
+        """
+        if name in self.areas:
+            return name
+        if len(name) >= self.min_prefix:
+            names = self.complete(name)
+            if len(names) == 1 and names[0][len(name)] != ' ':
+                return names[0]
+        distances = self.nearest(name)
+        if len(distances) == 1 or len(distances) > 1 and distances[0][0] < distances[1][0]:
+            return distances[0][1]
+        return None
+
+    def lookup(self, city: str, confident: bool = True) -> Optional[List[City]]:
+        """
+        Returns the areas for the city name if there is a confident match in the index
+        (or a suggestion if confident is False)
+        """
+        name = normalize(city)
+        with self._lock:
+            if not self.loaded:
+                self.load()
+            if not name:
+                return None
+            match = self.match(name) if confident else self.suggest(name)
+            if match is None:
+                return None
+            logger.info(f'Gazetteer: "{city}" {"matched" if confident else "suggested"} "{match}"')
+            return list(self.areas[match])
+
+
+gazetteer = Gazetteer()
+
+
+def find_areas(city: str) -> List[City]:
+    """
+    Returns the areas for the city name from the gazetteer. The API is requested if there is no confident match,
+    the suggestion of the gazetteer is used only if the API knows nothing about the name.
+    """
+    areas = gazetteer.lookup(city)
+    if areas is None:
+        areas = get_areas(city)
+        gazetteer.add(city, areas)
+    if not areas:
+        areas = gazetteer.lookup(city, confident=False) or areas
+    return areas
@@ -0,0 +1,36 @@
+import csv
+import io
+import json
+import tempfile
+from typing import IO, Tuple
+
+from loader import db
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+
+def write_history(user_id: int, file_format: str) -> Tuple[IO[bytes], int]:
+    """
+    Writes the requests of the user with their hotels to a temporary file in CSV or JSON Lines format.
+    The entries go from the database cursor straight to the file, the file is written by buffered chunks.
+    Returns the file (positioned at the start) and the number of written entries.
+    """
+    file = tempfile.TemporaryFile()
+    text = io.TextIOWrapper(file, encoding='utf-8', newline='', write_through=False)
+    entries = db.iterate_history(user_id=user_id)
+    columns = next(entries)
+    amount = 0
+    if file_format == 'csv':
+        writer = csv.writer(text)
+        writer.writerow(columns)
+        for entry in entries:
+            writer.writerow(entry)
+            amount += 1
+    else:
+        for entry in entries:
+            text.write(json.dumps(dict(zip(columns, entry)), ensure_ascii=False) + '\n')
+            amount += 1
+    text.flush()
+    text.detach()
+    file.seek(0)
+    return file, amount
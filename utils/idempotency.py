@@ -0,0 +1,47 @@
+import functools
+from typing import Awaitable, Callable, Hashable, Tuple
+
+from aiogram import types
+from loguru import logger
+
+from loader import dp
+from utils.cache import callback_cache
+
+"""
+Idempotent callbacks. A tap is identified by the chat, the message and its version (the time of the last edit),
+the state of the dialog and the callback data. The repeated taps of the same button (a double click on a slow
+connection) are acknowledged at once while the first tap is being handled and for config.CALLBACK_TTL seconds
+after it, the handler runs only once. A tap on the edited message is a new one.
+"""
+
+
+async def get_callback_key(callback: types.CallbackQuery) -> Tuple[Hashable, ...]:
+    """
+    Returns the key of the tap
+    """
+    message = callback.message
+    state = await dp.current_state(chat=message.chat.id, user=callback.from_user.id).get_state()
+    return message.chat.id, message.message_id, message.edit_date, state, callback.data
+
+
+def idempotent(ack: str) -> Callable:
+    """
+    Makes the callback handler idempotent: the repeated tap is answered with the ack text
+    instead of running the handler again. If the handler fails, the tap may be repeated.
+    """
+    def decorator(handler: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+        @functools.wraps(handler)
+        async def wrapper(callback: types.CallbackQuery, *args, **kwargs):
+            key = await get_callback_key(callback)
+            if key in callback_cache:
+                logger.info(f'Repeated callback {callback.data} in chat {callback.message.chat.id} is skipped')
+                await callback.answer(ack)
+                return
+            callback_cache.set(key, True)
+            try:
+                return await handler(callback, *args, **kwargs)
+            except Exception:
+                callback_cache.pop(key)
+                raise
+        return wrapper
+    return decorator
@@ -0,0 +1,110 @@
+import sys
+import time
+from typing import Dict, Tuple
+
+from loguru import logger
+
+from data import config
+
+"""
+Logging pipeline. Every sink is enqueued: a record is put into a queue and written by a background thread, so the
+event loop never waits for the disk. Records are split into categories (sql, http, handlers, app) by the module that
+logged them, each category has its own level, and repetitive lines are sampled.
+"""
+
+CATEGORIES = {
+    'database': 'sql',
+    'utils.rapidapi': 'http',
+    'handlers': 'handlers',
+}
+
+category_levels = {
+    'sql': logger.level(config.LOG_LEVEL_SQL).no,
+    'http': logger.level(config.LOG_LEVEL_HTTP).no,
+    'handlers': logger.level(config.LOG_LEVEL_HANDLERS).no,
+    'app': logger.level(config.LOG_LEVEL).no,
+}
+
+
+def get_category(module_name: str) -> str:
+    """
+    Returns the log category of the module
+    """
+    for prefix, category in CATEGORIES.items():
+        if module_name.startswith(prefix):
+            return category
+    return 'app'
+
+
+def is_enabled(category: str, level: str) -> bool:
+    """
+    Checks if the records of the level are written for the category
+    """
+    return logger.level(level).no >= category_levels[category]
+
+
+class Sampler:
+    """
+    Rate limiter of repetitive lines: no more than `limit` records from one line of code per `window` seconds.
+    The first record after a pause gets the number of skipped records in extra['suppressed'].
+    Args:
+        limit (int): the number of records per window
+        window (float): the window length in seconds
+    """
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self.counters: Dict[Tuple[str, int], list] = {}
+
+    def __call__(self, record: dict) -> bool:
+        if self.limit <= 0 or record['level'].no >= logger.level('WARNING').no:
+            return True
+        key = (record['name'], record['line'])
+        now = time.monotonic()
+        counter = self.counters.get(key)
+        if counter is None or now - counter[0] >= self.window:
+            suppressed = counter[2] if counter else 0
+            self.counters[key] = [now, 1, 0]
+            if suppressed:
+                record['extra']['suppressed'] = suppressed
+            return True
+        if counter[1] < self.limit:
+            counter[1] += 1
+            return True
+        counter[2] += 1
+        return False
+
+
+sampler = Sampler(limit=config.LOG_SAMPLE_LIMIT, window=config.LOG_SAMPLE_WINDOW)
+
+
+def log_filter(record: dict) -> bool:
+    """
+    Level control by category and sampling. The decision is made once per record and shared by all sinks
+    """
+    extra = record['extra']
+    if 'accepted' not in extra:
+        category = extra.setdefault('category', get_category(record['name'] or ''))
+        extra['accepted'] = record['level'].no >= category_levels.get(category, category_levels['app']) \
+            and sampler(record)
+    return extra['accepted']
+
+
+def setup_logging() -> None:
+    """
+    Replaces the default synchronous sink with background sinks: console and the log file (JSON lines if LOG_JSON)
+    """
+    logger.remove()
+    min_level = min(category_levels.values())
+    logger.add(sys.stderr, level='INFO', filter=log_filter, enqueue=True)
+    logger.add(
+        config.LOG_FILE,
+        format="{time} {level} {extra[category]} {message}",
+        level=min_level,
+        filter=log_filter,
+        serialize=config.LOG_JSON,
+        enqueue=True,
+        rotation="1 week",
+        compression="zip",
+    )
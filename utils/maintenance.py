@@ -0,0 +1,72 @@
+import asyncio
+import datetime
+import time
+
+from loguru import logger
+
+from data import config
+from loader import db, dp
+from utils.cache import history_cache
+from utils.notify_admins import on_starting_notify
+
+
+def get_retention_rules() -> list:
+    """
+    Returns the tables, the conditions of expired entries and their parameters according to the retention settings
+    """
+    now = datetime.datetime.now()
+    callback_date = str(now - datetime.timedelta(days=config.RETENTION_CALLBACK_DAYS))
+    hotel_date = str(now - datetime.timedelta(days=config.RETENTION_HOTEL_DAYS))
+    request_date = str(now - datetime.timedelta(days=config.RETENTION_REQUEST_DAYS))
+    photo_date = str(now - datetime.timedelta(days=config.RETENTION_PHOTO_DAYS))
+    search_job_date = str(now - datetime.timedelta(days=config.RETENTION_SEARCH_JOB_DAYS))
+    return [
+        ('Callback', 'date_create < ? OR date_create IS NULL', (callback_date,)),
+        ('Hotel', 'date_report < ? OR request_id IN (SELECT id FROM UserRequests WHERE date_request < ?)',
+         (hotel_date, request_date)),
+        ('Watch', 'request_id NOT IN (SELECT id FROM UserRequests WHERE date_request >= ? AND check_in >= ?)',
+         (request_date, str(now.date()))),
+        ('UserRequests', 'date_request < ?', (request_date,)),
+        ('ApiUsage', 'day < ?', (request_date[:10],)),
+        ('Stats', 'day < ?', (request_date[:10],)),
+        ('Property', 'hotel_id NOT IN (SELECT hotel_id FROM Hotel)', ()),
+        ('Photo', 'date_upload < ?', (photo_date,)),
+        ('SearchJob', "status IN ('done', 'failed', 'cancelled') AND date_update < ?", (search_job_date,)),
+    ]
+
+
+def maintain_database() -> str:
+    """
+    Removes expired entries by small batches (the database is locked only for one batch at a time),
+    returns free pages to the file system and updates the statistics. Returns the report.
+    """
+    size_before, _ = db.get_size()
+    removed = {}
+    for table, condition, parameters in get_retention_rules():
+        removed[table] = 0
+        while True:
+            amount = db.delete_expired(table, condition, parameters, batch_size=config.MAINTENANCE_BATCH)
+            removed[table] += amount
+            if amount < config.MAINTENANCE_BATCH:
+                break
+            time.sleep(config.MAINTENANCE_PAUSE)
+    history_cache.clear()
+    db.compact()
+    size_after, _ = db.get_size()
+    removed_text = ', '.join(f'{table}: {amount}' for table, amount in removed.items())
+    return f'Обслуживание базы данных.\nУдалено записей: {removed_text}\n' \
+           f'Размер: {size_before / 1024:.0f} КБ → {size_after / 1024:.0f} КБ ' \
+           f'(освобождено {(size_before - size_after) / 1024:.0f} КБ)'
+
+
+@logger.catch
+async def run_maintenance() -> None:
+    """
+    Runs the database maintenance every config.MAINTENANCE_INTERVAL seconds in a worker thread
+    and sends the report to the bot admins
+    """
+    while True:
+        report = await asyncio.to_thread(maintain_database)
+        logger.info(report)
+        await on_starting_notify(dp, report)
+        await asyncio.sleep(config.MAINTENANCE_INTERVAL)
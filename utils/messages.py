@@ -0,0 +1,46 @@
+from contextlib import suppress
+from typing import Optional
+
+from aiogram import types
+from aiogram.utils.exceptions import BadRequest, MessageCantBeDeleted, MessageNotModified, MessageToDeleteNotFound
+from loguru import logger
+
+from loader import bot
+
+
+async def edit_or_resend(message: types.Message, text: str, reply_markup: Optional[types.InlineKeyboardMarkup] = None,
+                         parse_mode: Optional[str] = None) -> None:
+    """
+    Replaces the text and the keyboard of the bot message.
+    If the message can no longer be edited (too old, deleted, a photo), it is deleted and sent again.
+    """
+    try:
+        await message.edit_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+    except MessageNotModified:
+        pass
+    except BadRequest as err:
+        logger.info(f'Message can not be edited: {err}')
+        with suppress(MessageCantBeDeleted, MessageToDeleteNotFound):
+            await message.delete()
+        await message.answer(text, parse_mode=parse_mode, reply_markup=reply_markup)
+
+
+async def edit_or_send(chat_id: int, message_id: Optional[int], text: str,
+                       reply_markup: Optional[types.InlineKeyboardMarkup] = None,
+                       parse_mode: Optional[str] = None) -> None:
+    """
+    Replaces the text and the keyboard of the bot message by its id (used outside of the handlers).
+    If the message can no longer be edited, a new one is sent.
+    """
+    if message_id is not None:
+        try:
+            await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, parse_mode=parse_mode,
+                                        reply_markup=reply_markup)
+            return
+        except MessageNotModified:
+            return
+        except BadRequest as err:
+            logger.info(f'Message can not be edited: {err}')
+            with suppress(MessageCantBeDeleted, MessageToDeleteNotFound):
+                await bot.delete_message(chat_id, message_id)
+    await bot.send_message(chat_id, text, parse_mode=parse_mode, reply_markup=reply_markup)
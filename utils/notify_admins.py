@@ -2,14 +2,16 @@ from loguru import logger
 
 from aiogram import Dispatcher
 from data.config import ADMINS
+from utils.outbound import low_priority
 
 
 async def on_starting_notify(dp: Dispatcher, text: str) -> None:
     """
-    Sends a message to bot admins
+    Sends a message to bot admins. The messages wait for the interactive replies in the outbound queue
     """
-    for admin in ADMINS:
-        try:
-            await dp.bot.send_message(admin, text)
-        except (KeyboardInterrupt, SystemExit) as err:
-            logger.error(err)
+    with low_priority():
+        for admin in ADMINS:
+            try:
+                await dp.bot.send_message(admin, text)
+            except (KeyboardInterrupt, SystemExit) as err:
+                logger.error(err)
@@ -0,0 +1,252 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from aiogram.utils.exceptions import RetryAfter
+from loguru import logger
+
+from data import config
+from utils.tracing import TracedBot
+
+"""
+Outbound queue of the Bot API calls addressed to a chat. The calls are paced by a global and a per-chat token bucket,
+calls of one chat are sent one at a time in order, interactive replies go before admin notices. A RetryAfter answer
+pauses the chat and the call is repeated. Pending edits of a message are merged (the newest text wins), a repeated
+delete of a message is attached to the pending one and a delete supersedes the pending edits of the message.
+"""
+
+INTERACTIVE = 0
+NOTICE = 1
+MERGED_METHODS = ('deleteMessage', 'editMessageText', 'editMessageReplyMarkup', 'editMessageCaption')
+
+send_priority: contextvars.ContextVar[int] = contextvars.ContextVar('send_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def low_priority() -> Iterator[None]:
+    """
+    The messages sent inside the block wait for the interactive replies
+    """
+    token = send_priority.set(NOTICE)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+class TokenBucket:
+    """
+    Token bucket: rate tokens per second, no more than capacity tokens at once
+    Args:
+        rate (float): tokens per second
+        capacity (float): the bucket size (burst)
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """
+        Returns the number of seconds until a token is available
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(self.blocked_until - now, (1 - self.tokens) / self.rate, 0.0)
+
+    def take(self) -> None:
+        """
+        Takes a token
+        """
+        self.tokens -= 1
+
+    def block(self, now: float, seconds: float) -> None:
+        """
+        Gives no tokens for the number of seconds
+        """
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class Job:
+    """
+    One Bot API call waiting in the queue
+    """
+    __slots__ = ('priority', 'seq', 'method', 'data', 'files', 'kwargs', 'chat_id', 'key', 'future', 'context',
+                 'attempts')
+
+    def __init__(self, priority: int, seq: int, method: str, data: Dict, files: Optional[Dict], kwargs: Dict,
+                 chat_id: Any, key: Optional[Tuple]):
+        self.priority = priority
+        self.seq = seq
+        self.method = method
+        self.data = data
+        self.files = files
+        self.kwargs = kwargs
+        self.chat_id = chat_id
+        self.key = key
+        self.future = asyncio.get_running_loop().create_future()
+        self.context = contextvars.copy_context()
+        self.attempts = 0
+
+    def __lt__(self, other: 'Job') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundQueue:
+    """
+    Queue of the Bot API calls addressed to chats
+    Args:
+        global_rate (float): calls per second for the whole bot
+        chat_rate (float): calls per second for one chat
+        chat_burst (float): calls which can be sent to one chat at once
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_buckets: Dict[Any, TokenBucket] = {}
+        self.heap: List[Job] = []
+        self.pending: Dict[Tuple, Job] = {}
+        self.busy: Set[Any] = set()
+        self.counter = itertools.count()
+        self.wakeup: Optional[asyncio.Event] = None
+        self.worker: Optional[asyncio.Task] = None
+
+    def get_chat_bucket(self, chat_id: Any) -> TokenBucket:
+        """
+        Returns the token bucket of the chat
+        """
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                now = time.monotonic()
+                self.chat_buckets = {key: value for key, value in self.chat_buckets.items()
+                                     if value.delay(now) > 0 or key in self.busy}
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def submit(self, send: Callable[..., Awaitable], method: str, data: Optional[Dict], files: Optional[Dict],
+                     **kwargs) -> Any:
+        """
+        Puts the call into the queue and returns its result. The calls which are not addressed to a chat
+        (getUpdates, answerCallbackQuery, ...) are made at once.
+        """
+        chat_id = (data or {}).get('chat_id')
+        if chat_id is None:
+            return await send(method, data, files, **kwargs)
+        chat_id = str(chat_id)
+        if self.worker is None or self.worker.done():
+            self.wakeup = asyncio.Event()
+            self.worker = asyncio.create_task(self.work(send))
+        key = (method, chat_id, data.get('message_id')) if method in MERGED_METHODS else None
+        if key is not None and key in self.pending:
+            job = self.pending[key]
+            if method != 'deleteMessage':
+                job.data, job.files = data, files
+            logger.debug(f'Outbound: {method} merged with the pending call, chat {chat_id}')
+            return await asyncio.shield(job.future)
+        if method == 'deleteMessage':
+            self.drop_edits(chat_id, data.get('message_id'))
+        job = Job(priority=send_priority.get(), seq=next(self.counter), method=method, data=data, files=files,
+                  kwargs=kwargs, chat_id=chat_id, key=key)
+        heapq.heappush(self.heap, job)
+        if key is not None:
+            self.pending[key] = job
+        self.wakeup.set()
+        return await asyncio.shield(job.future)
+
+    def drop_edits(self, chat_id: str, message_id: Any) -> None:
+        """
+        Removes the pending edits of the message which is going to be deleted
+        """
+        for method in MERGED_METHODS[1:]:
+            job = self.pending.pop((method, chat_id, message_id), None)
+            if job is not None:
+                self.heap.remove(job)
+                heapq.heapify(self.heap)
+                job.future.set_result(True)
+
+    def pick(self, now: float) -> Tuple[Optional[Job], float]:
+        """
+        Returns the first job (by priority and order) whose chat is ready, or the time to wait
+        """
+        wait = 1.0
+        global_delay = self.global_bucket.delay(now)
+        if global_delay > 0:
+            return None, global_delay
+        for job in sorted(self.heap):
+            if job.chat_id in self.busy:
+                continue
+            delay = self.get_chat_bucket(job.chat_id).delay(now)
+            if delay <= 0:
+                return job, 0.0
+            wait = min(wait, delay)
+        return None, wait
+
+    async def work(self, send: Callable[..., Awaitable]) -> None:
+        """
+        Sends the jobs from the queue while respecting the limits
+        """
+        while True:
+            self.wakeup.clear()
+            if not self.heap:
+                await self.wakeup.wait()
+                continue
+            job, wait = self.pick(time.monotonic())
+            if job is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.heap.remove(job)
+            heapq.heapify(self.heap)
+            if job.key is not None and self.pending.get(job.key) is job:
+                del self.pending[job.key]
+            self.global_bucket.take()
+            self.get_chat_bucket(job.chat_id).take()
+            self.busy.add(job.chat_id)
+            job.context.run(asyncio.create_task, self.dispatch(send, job))
+
+    async def dispatch(self, send: Callable[..., Awaitable], job: Job) -> None:
+        """
+        Makes the call. After RetryAfter the chat is paused and the job is put back into the queue
+        """
+        try:
+            result = await send(job.method, job.data, job.files, **job.kwargs)
+        except RetryAfter as err:
+            job.attempts += 1
+            logger.warning(f'Outbound: {err}, chat {job.chat_id}, attempt {job.attempts}')
+            if job.attempts > config.SEND_RETRY_ATTEMPTS:
+                job.future.set_exception(err)
+            else:
+                self.get_chat_bucket(job.chat_id).block(time.monotonic(), err.timeout)
+                heapq.heappush(self.heap, job)
+        except Exception as err:
+            job.future.set_exception(err)
+        else:
+            job.future.set_result(result)
+        finally:
+            self.busy.discard(job.chat_id)
+            self.wakeup.set()
+
+
+outbound_queue = OutboundQueue(global_rate=config.SEND_GLOBAL_RATE, chat_rate=config.SEND_CHAT_RATE,
+                               chat_burst=config.SEND_CHAT_BURST)
+
+
+class QueuedBot(TracedBot):
+    """
+    Bot whose Bot API calls addressed to a chat go through the outbound queue
+    """
+
+    async def request(self, method: str, data: Optional[Dict] = None, files: Optional[Dict] = None, **kwargs):
+        return await outbound_queue.submit(super().request, method, data, files, **kwargs)
@@ -0,0 +1,76 @@
+import datetime
+from typing import Dict, List
+
+from aiogram import types
+from aiogram.types import MediaGroup
+from aiogram.utils.exceptions import BadRequest
+from loguru import logger
+
+from loader import db
+
+"""
+Cache of the Telegram file_id of hotel photos. Telegram downloads a photo by link only the first time, after that
+the album is sent with file_id and appears almost instantly. The file_id are stored in the Photo table and are shared
+by all users; file_ids is an in-memory copy of the used rows.
+"""
+
+file_ids: Dict[str, str] = {}
+
+
+def get_file_ids(photos: List[str]) -> Dict[str, str]:
+    """
+    Returns the known file_id for the photo links
+    """
+    unknown = [url for url in photos if url not in file_ids]
+    if unknown:
+        file_ids.update(db.get_photos(unknown))
+    return {url: file_ids[url] for url in photos if url in file_ids}
+
+
+def get_album(photos: List[str], cached: Dict[str, str]) -> MediaGroup:
+    """
+    Returns the album where the photo is attached by file_id if it is known, otherwise by link
+    """
+    album = MediaGroup()
+    for url in photos:
+        album.attach_photo(photo=cached.get(url, url))
+    return album
+
+
+def remember_album(photos: List[str], messages: List[types.Message]) -> None:
+    """
+    Saves the file_id which Telegram returned for the photos sent by link
+    """
+    for url, message in zip(photos, messages):
+        if url in file_ids or not message.photo:
+            continue
+        file_id = message.photo[-1].file_id
+        file_ids[url] = file_id
+        db.add_photo(url=url, file_id=file_id, date_upload=datetime.datetime.now())
+
+
+def forget_photos(photos: List[str]) -> None:
+    """
+    Removes the file_id of the photos from the cache
+    """
+    for url in photos:
+        file_ids.pop(url, None)
+    db.delete_photos(photos)
+
+
+async def send_album(message: types.Message, photos: List[str]) -> None:
+    """
+    Sends the photo album to the chat of the message reusing the cached file_id.
+    If Telegram rejects a cached file_id, the album is sent again by links.
+    """
+    cached = get_file_ids(photos)
+    logger.info(f'Album: {len(cached)} of {len(photos)} photos from the file_id cache')
+    try:
+        messages = await message.answer_media_group(media=get_album(photos, cached))
+    except BadRequest as err:
+        if not cached:
+            raise
+        logger.error(err)
+        forget_photos(list(cached))
+        messages = await message.answer_media_group(media=get_album(photos, {}))
+    remember_album(photos, messages)
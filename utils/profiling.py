@@ -0,0 +1,159 @@
+import asyncio
+import io
+import os
+import pickle
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.types import InputFile
+from aiogram.utils.exceptions import TelegramAPIError
+from loguru import logger
+
+from data import config
+from loader import bot, storage
+from utils.outbound import low_priority
+
+"""
+On-demand profiling. While the profile runs, a sampler thread takes the stack of the event loop thread every
+config.PROFILE_INTERVAL seconds, and tracemalloc traces the allocations. The samples are written in the collapsed
+stacks format (one 'frame;frame;frame count' line per stack, the input of flamegraph.pl and speedscope).
+The memory report has the top sites of the memory allocated during the profile and still in use, the RSS and
+its high watermark, and the size of the FSM storage by data key. Nothing runs and nothing is traced while
+no profile is requested.
+"""
+
+profiling = threading.Lock()
+
+
+def get_frame_name(frame) -> str:
+    """
+    Returns the name of the stack frame: module:function
+    """
+    return f'{frame.f_globals.get("__name__", "?")}:{frame.f_code.co_name}'
+
+
+def sample_stacks(thread_id: int, seconds: float, interval: float) -> Tuple[Counter, int]:
+    """
+    Samples the stack of the thread during the seconds. Returns the collapsed stacks with their sample counts
+    and the number of samples
+    """
+    stacks: Counter = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        names = []
+        while frame is not None:
+            names.append(get_frame_name(frame))
+            frame = frame.f_back
+        if names:
+            stacks[';'.join(reversed(names))] += 1
+            samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+
+def get_memory_usage() -> Dict[str, int]:
+    """
+    Returns the resident set size of the process and its high watermark (KB)
+    """
+    usage = {}
+    try:
+        with open('/proc/self/status', encoding='utf-8') as file:
+            for line in file:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    name, value = line.split(':', 1)
+                    usage[name] = int(value.split()[0])
+    except OSError:
+        import resource
+        usage['VmHWM'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage
+
+
+def get_storage_sizes() -> Tuple[int, List[Tuple[str, int, int]]]:
+    """
+    Returns the number of dialogs in the FSM storage and the pickled size of every data key:
+    (key, number of dialogs having the key, bytes) from the largest
+    """
+    sizes: Dict[str, List[int]] = {}
+    dialogs = 0
+    for chat in list(storage.data.values()):
+        for record in list(chat.values()):
+            dialogs += 1
+            for key, value in list(record.get('data', {}).items()):
+                try:
+                    size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+                except (pickle.PicklingError, TypeError, AttributeError):
+                    size = 0
+                item = sizes.setdefault(key, [0, 0])
+                item[0] += 1
+                item[1] += size
+    return dialogs, sorted(((key, amount, size) for key, (amount, size) in sizes.items()), key=lambda i: -i[2])
+
+
+def get_memory_report(snapshot: tracemalloc.Snapshot, seconds: float, samples: int) -> str:
+    """
+    Returns the text report: the memory usage, the top allocation sites and the FSM storage size
+    """
+    lines = [f'profile: {seconds:.0f} s, {samples} samples, pid {os.getpid()}', '']
+    for name, value in get_memory_usage().items():
+        lines.append(f'{"RSS" if name == "VmRSS" else "RSS peak"}: {value / 1024:.1f} MB')
+    lines.extend(['', f'top {config.PROFILE_TOP_SIZE} allocation sites '
+                      f'(memory allocated during the profile and still in use):'])
+    statistics = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)]).statistics('lineno')
+    for statistic in statistics[:config.PROFILE_TOP_SIZE]:
+        frame = statistic.traceback[0]
+        lines.append(f'{statistic.size / 1024:>10.1f} KB {statistic.count:>8} blocks  {frame.filename}:{frame.lineno}')
+    dialogs, sizes = get_storage_sizes()
+    lines.extend(['', f'FSM storage: {dialogs} dialogs, {sum(size for _, _, size in sizes) / 1024:.1f} KB'])
+    for key, amount, size in sizes:
+        lines.append(f'{size / 1024:>10.1f} KB {amount:>8} dialogs  {key}')
+    return '\n'.join(lines)
+
+
+async def run_profile(seconds: float) -> Optional[Tuple[str, str]]:
+    """
+    Profiles the process during the seconds. Returns the collapsed stacks and the memory report
+    (None if another profile is running)
+    """
+    if not profiling.acquire(blocking=False):
+        return None
+    try:
+        tracemalloc.start()
+        try:
+            stacks, samples = await asyncio.to_thread(sample_stacks, threading.get_ident(), seconds,
+                                                      config.PROFILE_INTERVAL)
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        report = await asyncio.to_thread(get_memory_report, snapshot, seconds, samples)
+    finally:
+        profiling.release()
+    folded = '\n'.join(f'{stack} {count}' for stack, count in stacks.most_common())
+    return folded, report
+
+
+@logger.catch
+async def send_profile(seconds: float) -> None:
+    """
+    Profiles the process and sends the collapsed stacks and the memory report as documents to config.ADMINS
+    """
+    logger.info(f'Profiling for {seconds:.0f} s')
+    result = await run_profile(seconds)
+    if result is None:
+        return
+    folded, report = result
+    name = time.strftime('%Y%m%d-%H%M%S')
+    with low_priority():
+        for admin in config.ADMINS:
+            try:
+                await bot.send_document(admin, InputFile(io.BytesIO(folded.encode()), filename=f'cpu-{name}.folded'),
+                                        caption='CPU: стеки в формате collapsed (flamegraph.pl, speedscope)')
+                await bot.send_document(admin, InputFile(io.BytesIO(report.encode()), filename=f'memory-{name}.txt'),
+                                        caption='Память: RSS, места выделения, FSM storage')
+            except TelegramAPIError as err:
+                logger.error(f'Profile is not sent to {admin}: {err}')
@@ -1,15 +1,25 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 from loguru import logger
 
 from data import config
-from utils.rapidapi.requests_to_api import post_request_to_api
+from utils.cache import detail_cache
+from utils.rapidapi.requests_to_api import post_request_to_api, is_url_available
+
+checked_photos: Dict[str, bool] = {}
 
 
 def get_detail_info(hotel_id: str) -> Dict:
     """
-    Returns additional information for hotel
+    Returns additional information for hotel. The answers are cached by the hotel id
+    (the address and the photos of a hotel are taken from the same answer).
     """
+    detail_info = detail_cache.get(hotel_id)
+    if detail_info is not None:
+        return detail_info
     url = "https://hotels4.p.rapidapi.com/properties/v2/detail"
 
     payload = {
@@ -26,6 +36,8 @@ def get_detail_info(hotel_id: str) -> Dict:
     }
     logger.info(f'Search for additional information for hotel {hotel_id}')
     detail_info = post_request_to_api(url=url, payload=payload, headers=headers)
+    if detail_info and detail_info.get('data') is not None:
+        detail_cache.set(hotel_id, detail_info)
     return detail_info
 
 
@@ -51,14 +63,11 @@ def get_photos(data: Dict[str, str], hotel_id: str) -> List[str]:
     amount_photo = data['amount_photos']
     try:
         photos_list = detail_info.get('data', {}).get('propertyInfo', {}).get('propertyGallery', {}).get(
-            'images', None)[:amount_photo]
-        photos = []
-        for photo_dict in photos_list:
-            photo_url = parse_url_photo(photo_dict)
-            photos.append(photo_url)
+            'images', None)
+        photos = select_photos([parse_url_photo(photo_dict) for photo_dict in photos_list], amount_photo)
         logger.info(f'Found photos for hotel {hotel_id}')
         return photos
-    except AttributeError as err:
+    except (AttributeError, TypeError) as err:
         logger.error(err)
         logger.error('Could not find photos')
         return []
@@ -66,7 +75,64 @@ def get_photos(data: Dict[str, str], hotel_id: str) -> List[str]:
 
 def parse_url_photo(photo_dict: dict) -> str:
     """
-    Returns photo link
+    Returns photo link resized to the width no more than config.PHOTO_WIDTH
     """
     photo_url = photo_dict.get('image', {}).get('url', None)
-    return photo_url
+    if photo_url is None:
+        return None
+    return resize_url_photo(photo_url, config.PHOTO_WIDTH)
+
+
+def resize_url_photo(photo_url: str, width: int) -> str:
+    """
+    Returns the link to the photo variant no wider than the given width (the photo is never enlarged).
+    The image server of hotels.com (trvl-media.com) resizes the photo by the parameters impolicy, rw and ra.
+    """
+    url = urlsplit(photo_url)
+    if not url.netloc.endswith('trvl-media.com'):
+        return photo_url
+    query = dict(parse_qsl(url.query))
+    if query.get('rw', '').isdigit() and int(query['rw']) <= width:
+        return photo_url
+    query.update({'impolicy': 'resizecrop', 'rw': str(width), 'ra': 'fit'})
+    return urlunsplit(url._replace(query=urlencode(query)))
+
+
+def select_photos(photos_list: List[str], amount_photo: int) -> List[str]:
+    """
+    Returns no more than amount_photo links: without duplicates and, if config.PHOTO_CHECK, without dead links.
+    The links are checked in parallel in groups of amount_photo (in the context of the search).
+    """
+    if amount_photo <= 0:
+        return []
+    candidates = []
+    seen = set()
+    for photo_url in photos_list:
+        key = photo_url.split('?')[0] if photo_url else None
+        if key and key not in seen:
+            seen.add(key)
+            candidates.append(photo_url)
+    if not config.PHOTO_CHECK:
+        return candidates[:amount_photo]
+    photos = []
+    with ThreadPoolExecutor(max_workers=max(amount_photo, 1)) as executor:
+        for start in range(0, len(candidates), amount_photo):
+            group = candidates[start:start + amount_photo]
+            checks = [executor.submit(contextvars.copy_context().run, check_photo, photo_url) for photo_url in group]
+            for photo_url, available in zip(group, (check.result() for check in checks)):
+                if available and len(photos) < amount_photo:
+                    photos.append(photo_url)
+            if len(photos) == amount_photo:
+                break
+    return photos
+
+
+def check_photo(photo_url: str) -> bool:
+    """
+    Checks if the photo link is available. The result is remembered.
+    """
+    if photo_url not in checked_photos:
+        if len(checked_photos) >= 10000:
+            checked_photos.clear()
+        checked_photos[photo_url] = is_url_available(photo_url)
+    return checked_photos[photo_url]
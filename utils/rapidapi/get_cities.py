@@ -3,6 +3,7 @@ from typing import Dict, NamedTuple, List
 from loguru import logger
 
 from data import config
+from utils.cache import location_cache
 from utils.rapidapi.requests_to_api import get_request_to_api
 
 
@@ -23,8 +24,15 @@ def get_city_info(city: str) -> Dict:
         "X-RapidAPI-Key": config.RAPID_API_KEY,
         "X-RapidAPI-Host": config.RAPID_API_HOST
     }
+    key = city.strip().lower()
+    city_data = location_cache.get(key)
+    if city_data is not None:
+        logger.info(f'Search {city} (cache)')
+        return city_data
     logger.info(f'Search {city}')
     city_data = get_request_to_api(url=url, headers=headers, querystring=querystring)
+    if city_data:
+        location_cache.set(key, city_data)
     return city_data
 
 
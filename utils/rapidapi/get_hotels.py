@@ -1,12 +1,24 @@
-from typing import Dict, NamedTuple, List, Optional, Any
+import heapq
+import json
+import math
+from typing import Dict, NamedTuple, List, Optional, Any, Callable, Iterable, Iterator, Tuple
 
+import numpy as np
 from loguru import logger
 
 from data import config
+from utils.cache import TTLCache, hotels_cache, page_size_cache, tile_cache
+from utils.cancellation import deadline_passed
+from utils.geo import encode_geohash, decode_geohash, get_distance, get_distances
 from utils.rapidapi.get_address_photos import get_address, get_photos
 from utils.rapidapi.requests_to_api import post_request_to_api
 
 
+KM_PER_MILE = 1.6
+LIST_PAGE_SIZE = 200
+PAGE_SIZE_STEPS = (25, 50, 100, LIST_PAGE_SIZE)
+
+
 class Hotel(NamedTuple):
     hotel_id: str
     name: str
@@ -16,11 +28,95 @@ class Hotel(NamedTuple):
     center: float
 
 
-def get_hotels_info(data: Dict[str, Any]) -> Dict:
+class PropertyBatch:
     """
-    Returns information about hotels
+    Columnar view of the list of properties from properties/v2/list: NumPy arrays built once per response.
+    Filters return a new batch with the selected rows, the property dicts are not copied.
+    Args:
+        properties (list): the properties (dicts) of the API response
+    """
+
+    def __init__(self, properties: List[dict]):
+        self.properties = properties
+        amount = len(properties)
+        self.index = np.arange(amount)
+        self.price = np.fromiter((parse_hotel_price(hotel) for hotel in properties), dtype=float, count=amount)
+        self.distance = np.fromiter((parse_hotel_center(hotel) for hotel in properties), dtype=float, count=amount)
+        self.latitude = np.fromiter((parse_hotel_coordinate(hotel, 'latitude') for hotel in properties),
+                                    dtype=float, count=amount)
+        self.longitude = np.fromiter((parse_hotel_coordinate(hotel, 'longitude') for hotel in properties),
+                                     dtype=float, count=amount)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def take(self, rows: np.ndarray) -> 'PropertyBatch':
+        """
+        Returns the batch with the rows selected by a boolean mask or by positions
+        """
+        batch = PropertyBatch.__new__(PropertyBatch)
+        batch.properties = self.properties
+        for column in ('index', 'price', 'distance', 'latitude', 'longitude'):
+            setattr(batch, column, getattr(self, column)[rows])
+        return batch
+
+    def localize(self, latitude: float, longitude: float) -> 'PropertyBatch':
+        """
+        Returns the batch with the distances (miles) from the point instead of the distances from the tile center.
+        The distance of a property without coordinates is left as is.
+        """
+        batch = self.take(slice(None))
+        distance = np.round(get_distances(latitude, longitude, self.latitude, self.longitude), 2)
+        batch.distance = np.where(np.isnan(distance), self.distance, distance)
+        return batch
+
+    @property
+    def distance_km(self) -> np.ndarray:
+        """
+        Distance to the center in km
+        """
+        return self.distance * KM_PER_MILE
+
+    def filter_window(self, price_min: float, price_max: float, center_min: float, center_max: float) -> \
+            'PropertyBatch':
+        """
+        Returns the properties with the price ($) and the distance to the center (km) inside the windows
+        """
+        distance_km = self.distance_km
+        mask = (self.price >= price_min) & (self.price <= price_max) & \
+               (distance_km >= center_min) & (distance_km <= center_max)
+        return self.take(mask)
+
+    def score(self, data: Dict[str, Any]) -> np.ndarray:
+        """
+        Returns the best deal score of the properties (the lower the better):
+        the weighted sum of the price and the distance normalised to [0, 1] inside the user windows
+        """
+        price = normalize(self.price, data['price_min'], data['price_max'])
+        distance = normalize(self.distance_km, data['center_min'], data['center_max'])
+        return config.BESTDEAL_PRICE_WEIGHT * price + config.BESTDEAL_DISTANCE_WEIGHT * distance
+
+    def rows(self) -> Iterator[Tuple[dict, float, float]]:
+        """
+        Returns the property dicts of the batch with their price and distance (miles)
+        """
+        for index, price, distance in zip(self.index, self.price, self.distance):
+            yield self.properties[index], float(price), float(distance)
+
+
+def normalize(values: np.ndarray, value_min: float, value_max: float) -> np.ndarray:
+    """
+    Returns the values scaled from the window [value_min, value_max] to [0, 1]
+    """
+    if value_max <= value_min:
+        return np.zeros_like(values)
+    return np.clip((values - value_min) / (value_max - value_min), 0, 1)
+
+
+def get_hotels_payload(data: Dict[str, Any]) -> Dict:
+    """
+    Returns the body of the hotel list request
     """
-    url = "https://hotels4.p.rapidapi.com/properties/v2/list"
     check_in_date = str(data['check_in']).split('-')
     check_out_date = str(data['check_out']).split('-')
     check_in_year, check_in_month, check_in_day = map(int, check_in_date)
@@ -39,7 +135,7 @@ def get_hotels_info(data: Dict[str, Any]) -> Dict:
         region_id = data['area_id']
         sort_order = 'DISTANCE'
         filters = {'price': {'max': data['price_max'], 'min': data['price_min']}}
-        page_size = 200
+        page_size = data.get('page_size', LIST_PAGE_SIZE)
         destination = {"regionId": region_id}
 
     elif data['command'] == 'в моём городе с учётом цены и расположения от центра':
@@ -47,7 +143,7 @@ def get_hotels_info(data: Dict[str, Any]) -> Dict:
         longitude = data['lon']
         sort_order = 'DISTANCE'
         filters = {'price': {'max': data['price_max'], 'min': data['price_min']}}
-        page_size = 200
+        page_size = data.get('page_size', LIST_PAGE_SIZE)
         destination = {"coordinates": {"latitude": latitude, "longitude": longitude}}
 
     payload = {
@@ -72,69 +168,212 @@ def get_hotels_info(data: Dict[str, Any]) -> Dict:
                 "children": []
             }
         ],
-        "resultsStartingIndex": 0,
+        "resultsStartingIndex": data.get('results_start', 0),
         "resultsSize": page_size,
         "sort": sort_order,
         "filters": filters
     }
+    return payload
 
+
+def get_hotels_cache_key(payload: Dict[str, Any]) -> str:
+    """
+    Returns the key of the hotel list request in the cache
+    """
+    return json.dumps(payload, sort_keys=True)
+
+
+def get_hotels_info(data: Dict[str, Any]) -> Dict:
+    """
+    Returns information about hotels
+    """
+    if data['command'] == 'в моём городе с учётом цены и расположения от центра':
+        return get_hotels_info_by_tile(data)
+    return request_hotels(data, hotels_cache)
+
+
+def request_hotels(data: Dict[str, Any], cache: TTLCache) -> Dict:
+    """
+    Makes the hotel list request if its result is not in the cache
+    """
+    url = "https://hotels4.p.rapidapi.com/properties/v2/list"
+    payload = get_hotels_payload(data)
     headers = {
         "content-type": "application/json",
         "X-RapidAPI-Key": config.RAPID_API_KEY,
         "X-RapidAPI-Host": config.RAPID_API_HOST
     }
+    key = get_hotels_cache_key(payload)
+    hotels_data = cache.get(key)
+    if hotels_data is not None:
+        logger.info(f'Search hotels ({cache.name} cache)')
+        return hotels_data
     logger.info('Search hotels')
     hotels_data = post_request_to_api(url=url, payload=payload, headers=headers)
+    if hotels_data and hotels_data.get('data') is not None:
+        cache.set(key, hotels_data)
     return hotels_data
 
 
-def get_hotels_list(data: Dict[str, Any]) -> List[Hotel]:
+def get_hotels_info_by_tile(data: Dict[str, Any]) -> Dict:
     """
-    Returns prepared list of hotels
+    Returns information about hotels near the user.
+    The coordinates are rounded to the center of the geohash tile, so all users of the tile share one request
+    (and one entry of the tile cache). The distances in the response are from the tile center, they are calculated
+    again from the exact user position by PropertyBatch.localize.
     """
+    tile = encode_geohash(data['lat'], data['lon'], config.GEO_TILE_PRECISION)
+    tile_latitude, tile_longitude = decode_geohash(tile)
+    logger.info(f'Search hotels in tile {tile}')
+    return request_hotels({**data, 'lat': tile_latitude, 'lon': tile_longitude}, tile_cache)
+
+
+def get_page_size_key(data: Dict[str, Any]) -> Tuple[str, int]:
+    """
+    Returns the key of the page size statistics: the region (or the geohash tile) and the distance window
+    rounded up to a whole km
+    """
+    if data['command'] == 'в моём городе с учётом цены и расположения от центра':
+        region = f'tile:{encode_geohash(data["lat"], data["lon"], config.GEO_TILE_PRECISION)}'
+    else:
+        region = f'region:{data["area_id"]}'
+    return region, math.ceil(float(data['center_max']))
+
+
+def predict_page_size(data: Dict[str, Any]) -> int:
+    """
+    Returns the size of the first hotel list page for the search with a distance window: the largest number
+    of results needed by the last searches of the region and the window plus config.PAGE_SIZE_MARGIN,
+    rounded up to one of PAGE_SIZE_STEPS (few sizes keep the list cache shared). Without statistics
+    the full page is requested.
+    """
+    needed = page_size_cache.get(get_page_size_key(data))
+    if not needed:
+        return LIST_PAGE_SIZE
+    expected = max(needed) * (1 + config.PAGE_SIZE_MARGIN)
+    return next((size for size in PAGE_SIZE_STEPS if size >= expected), LIST_PAGE_SIZE)
+
+
+def record_page_need(data: Dict[str, Any], needed: int) -> None:
+    """
+    Saves the number of results the search needed among the last config.PAGE_SIZE_HISTORY numbers
+    of the region and the window
+    """
+    key = get_page_size_key(data)
+    history = page_size_cache.get(key) or ()
+    page_size_cache.set(key, (history + (needed,))[-config.PAGE_SIZE_HISTORY:])
+
+
+def get_tile_offset(data: Dict[str, Any]) -> float:
+    """
+    Returns the distance (km) from the user to the center of the geohash tile the hotel list is sorted from
+    (0 for the region search)
+    """
+    if data['command'] != 'в моём городе с учётом цены и расположения от центра':
+        return 0.0
+    tile_latitude, tile_longitude = decode_geohash(encode_geohash(data['lat'], data['lon'],
+                                                                  config.GEO_TILE_PRECISION))
+    return get_distance(data['lat'], data['lon'], tile_latitude, tile_longitude) * KM_PER_MILE
+
+
+def get_hotels_list(data: Dict[str, Any], progress: Optional[Callable[[int, int], None]] = None) -> List[Hotel]:
+    """
+    Returns prepared list of hotels.
+    progress(number, amount) is called after each hotel is filled with the address and the photos.
+    When the deadline of the search passes, the hotels filled so far are returned.
+    """
+    if data['command'] != 'самые дешёвые':
+        data = {**data, 'page_size': predict_page_size(data)}
     hotels_result_api = get_hotels_info(data)
     logger.info('Processing the resulting list of hotels')
     if hotels_result_api is None or hotels_result_api.get('data') is None:
         return []
+    start_hotels_list = hotels_result_api.get('data', {}).get('propertySearch', {}).get('properties', None)
+    if data['command'] == 'самые дешёвые':
+        candidates = [(hotel, parse_hotel_price(hotel), parse_hotel_center(hotel)) for hotel in start_hotels_list]
+    elif data['command'] == 'по цене и расположению от центра' or \
+            data['command'] == 'в моём городе с учётом цены и расположения от центра':
+        pages = iter_property_pages(data, start_hotels_list or [])
+        candidates = rank_best_deals(pages, data, data['amount_hotels'])
     else:
-        start_hotels_list = hotels_result_api.get('data', {}).get('propertySearch', {}).get('properties', None)
-        if data['command'] == 'самые дешёвые':
-            result_hotels = []
-            for hotel in start_hotels_list:
-                result_hotels.append(
-                    Hotel(
-                        hotel_id=parse_hotel_id(hotel),
-                        name=parse_hotel_name(hotel),
-                        address=get_address(hotel_id=parse_hotel_id(hotel)),
-                        center=parse_hotel_center(hotel),
-                        price=parse_hotel_price(hotel),
-                        photos=get_hotel_photos(data, hotel)
-                    )
-                )
-            return result_hotels
-        elif data['command'] == 'по цене и расположению от центра' or \
-                data['command'] == 'в моём городе с учётом цены и расположения от центра':
-            center_min = round(data['center_min'] * 0.62)
-            center_max = round(data['center_max'] * 0.62)
-            amount_hotels = data['amount_hotels']
-
-            result_hotels = []
-            for hotel in start_hotels_list:
-                center = parse_hotel_center(hotel)
-                if center_min <= center <= center_max:
-                    result_hotels.append(
-                        Hotel(
-                            hotel_id=parse_hotel_id(hotel),
-                            name=parse_hotel_name(hotel),
-                            address=get_address(hotel_id=parse_hotel_id(hotel)),
-                            center=parse_hotel_center(hotel),
-                            price=parse_hotel_price(hotel),
-                            photos=get_hotel_photos(data, hotel)
-                        )
-                    )
-                if len(result_hotels) == amount_hotels:
-                    break
-            return result_hotels
+        return []
+    result_hotels = []
+    for number, (hotel, price, center) in enumerate(candidates, start=1):
+        if deadline_passed():
+            logger.warning(f'Only {len(result_hotels)} of {len(candidates)} hotels are ready by the deadline')
+            break
+        result_hotels.append(
+            Hotel(
+                hotel_id=parse_hotel_id(hotel),
+                name=parse_hotel_name(hotel),
+                address=get_address(hotel_id=parse_hotel_id(hotel)),
+                center=center,
+                price=price,
+                photos=get_hotel_photos(data, hotel)
+            )
+        )
+        if progress is not None:
+            progress(number, len(candidates))
+    return result_hotels
+
+
+def iter_property_pages(data: Dict[str, Any], first_page: List[dict]) -> Iterator[PropertyBatch]:
+    """
+    Returns the pages of the hotel list (sorted by distance) one by one: the first page of data['page_size']
+    results and then, while the pages are full and the list has not gone beyond the distance window,
+    the follow-up pages up to config.BESTDEAL_MAX_PAGES full pages of results in total.
+    The number of results up to the last hotel inside the window is saved for the page size prediction.
+    """
+    page = first_page
+    page_size = data.get('page_size', LIST_PAGE_SIZE)
+    limit = config.BESTDEAL_MAX_PAGES * LIST_PAGE_SIZE
+    center_max = float(data['center_max'])
+    offset = get_tile_offset(data)
+    fetched = needed = 0
+    while True:
+        batch = PropertyBatch(page)
+        if data['command'] == 'в моём городе с учётом цены и расположения от центра':
+            batch = batch.localize(data['lat'], data['lon'])
+        yield batch
+        inside = np.flatnonzero(batch.distance_km <= center_max)
+        if len(inside) > 0:
+            needed = fetched + int(inside[-1]) + 1
+        fetched += len(page)
+        passed = len(page) > 0 and batch.distance_km[-1] > center_max + 2 * offset
+        if len(page) < page_size or passed:
+            break
+        if fetched >= limit or deadline_passed():
+            needed = fetched
+            break
+        page_size = min(LIST_PAGE_SIZE, limit - fetched)
+        logger.info(f'Follow-up hotel list page from {fetched}')
+        hotels_result_api = get_hotels_info({**data, 'results_start': fetched, 'page_size': page_size})
+        if hotels_result_api is None or hotels_result_api.get('data') is None:
+            return
+        page = hotels_result_api.get('data', {}).get('propertySearch', {}).get('properties', None) or []
+    record_page_need(data, needed)
+
+
+def rank_best_deals(pages: Iterable[PropertyBatch], data: Dict[str, Any], amount: int) -> \
+        List[Tuple[dict, float, float]]:
+    """
+    Returns the amount best deals of all pages in one pass: the properties inside the price and center windows
+    with the lowest score. Only amount properties are kept in a heap at any moment.
+    """
+    heap = []
+    counter = 0
+    for page in pages:
+        batch = page.filter_window(price_min=data['price_min'], price_max=data['price_max'],
+                                   center_min=data['center_min'], center_max=data['center_max'])
+        for score, row in zip(batch.score(data), batch.rows()):
+            counter += 1
+            item = (-float(score), -counter, row)
+            if len(heap) < amount:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+    logger.info(f'{counter} hotels inside the price and center window, {len(heap)} best deals selected')
+    return [row for _, _, row in sorted(heap, reverse=True)]
 
 
 def parse_hotel_id(hotel_dict: dict) -> str:
@@ -158,6 +397,14 @@ def parse_hotel_center(hotel_dict: dict) -> float:
     return hotel_dict.get('destinationInfo', {}).get('distanceFromDestination', {}).get('value', 0)
 
 
+def parse_hotel_coordinate(hotel_dict: dict, coordinate: str) -> float:
+    """
+    Returns hotel latitude or longitude, NaN if it is unknown
+    """
+    value = hotel_dict.get('mapMarker', {}).get('latLong', {}).get(coordinate, None)
+    return math.nan if value is None else value
+
+
 def parse_hotel_price(hotel_dict: dict) -> float:
     """
     Returns hotel price per night ($)
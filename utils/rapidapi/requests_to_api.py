@@ -1,20 +1,111 @@
+import gzip
+import hashlib
 import json
-from typing import Dict, Any
+import os
+import time
+from typing import Dict, Any, NamedTuple, Optional
 
 import requests
 from loguru import logger
 
+from data import config
+from utils.accounting import count_api_call
+from utils.cancellation import get_session, get_timeout
+from utils.tracing import span
+
+"""
+Requests to the API. config.API_MODE switches the mode of all requests:
+- live: the requests go to the network;
+- record: the requests go to the network, the responses are saved to the cassette store config.CASSETTE_DIR;
+- replay: the responses are taken from the cassette store without the network, with the recorded latency multiplied
+  by config.API_REPLAY_LATENCY (0 - no delay).
+A cassette is a gzip-compressed JSON file named by the fingerprint of the request (method, url, query or payload;
+the headers with the API key are not part of it).
+"""
+
+
+class ApiResponse(NamedTuple):
+    status_code: int
+    text: str
+    content_type: str
+
+
+def get_fingerprint(method: str, url: str, body: Any) -> str:
+    """
+    Returns the fingerprint of the request
+    """
+    request = json.dumps([method, url, body], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(request.encode()).hexdigest()
+
+
+def get_cassette_path(fingerprint: str) -> str:
+    """
+    Returns the path of the cassette file
+    """
+    return os.path.join(config.CASSETTE_DIR, fingerprint[:2], f'{fingerprint}.json.gz')
+
+
+def record_response(method: str, url: str, body: Any, response: ApiResponse, elapsed: float) -> None:
+    """
+    Saves the response to the cassette store
+    """
+    path = get_cassette_path(get_fingerprint(method, url, body))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cassette = {'method': method, 'url': url, 'body': body, 'elapsed': round(elapsed, 4), **response._asdict()}
+    temp_path = f'{path}.{os.getpid()}.{time.monotonic_ns()}.tmp'
+    with gzip.open(temp_path, 'wt', encoding='utf-8') as file:
+        json.dump(cassette, file, ensure_ascii=False, default=str)
+    os.replace(temp_path, path)
+
+
+def replay_response(method: str, url: str, body: Any) -> ApiResponse:
+    """
+    Returns the response from the cassette store, waiting for the recorded latency
+    """
+    path = get_cassette_path(get_fingerprint(method, url, body))
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            cassette = json.load(file)
+    except FileNotFoundError:
+        raise LookupError(f'No recorded response for {method} {url}')
+    get_session()
+    if config.API_REPLAY_LATENCY > 0:
+        time.sleep(min(cassette['elapsed'] * config.API_REPLAY_LATENCY, get_timeout(30)))
+    return ApiResponse(status_code=cassette['status_code'], text=cassette['text'],
+                       content_type=cassette['content_type'])
+
+
+def send_request(method: str, url: str, headers: Optional[Dict[str, str]] = None, params: Optional[Dict] = None,
+                 payload: Optional[Dict] = None, timeout: float = 30) -> ApiResponse:
+    """
+    Makes the request according to config.API_MODE.
+    Inside a search the request uses the session of the search and respects its deadline.
+    """
+    body = params if params is not None else payload
+    if config.API_MODE == 'replay':
+        return replay_response(method, url, body)
+    started = time.monotonic()
+    response = get_session().request(method, url, headers=headers, params=params, json=payload,
+                                     timeout=get_timeout(timeout), allow_redirects=True)
+    logger.debug(response)
+    result = ApiResponse(status_code=response.status_code, text=response.text,
+                         content_type=response.headers.get('content-type', ''))
+    if config.API_MODE == 'record':
+        record_response(method, url, body, result, time.monotonic() - started)
+    return result
+
 
 def get_request_to_api(url: str, headers: Dict[str, str], querystring: Dict[str, str]) -> Dict:
     """
-    Makes a GET request to the API. Returns data
+    Makes a GET request to the API. Returns data. The call is counted for the current user
     """
+    count_api_call()
     try:
-        response = requests.get(url, headers=headers, params=querystring, timeout=30)
-        logger.info(response)
+        with span('api.get', endpoint=url.split('.com/')[-1]):
+            response = send_request('GET', url, headers=headers, params=querystring)
         if response.status_code != 200:
             raise LookupError(f'Status code {response.status_code}')
-        if not response:
+        if not response.text:
             return {}
         data = json.loads(response.text)
         if not data:
@@ -26,14 +117,15 @@ def get_request_to_api(url: str, headers: Dict[str, str], querystring: Dict[str,
 
 def post_request_to_api(url: str, payload: Dict[str, Any], headers: Dict[str, str]) -> Dict:
     """
-    Makes a POST request to the API. Returns data
+    Makes a POST request to the API. Returns data. The call is counted for the current user
     """
+    count_api_call()
     try:
-        response = requests.request("POST", url, json=payload, headers=headers)
-        logger.info(response)
+        with span('api.post', endpoint=url.split('.com/')[-1]):
+            response = send_request('POST', url, headers=headers, payload=payload)
         if response.status_code != 200:
             raise LookupError(f'Status code {response.status_code}')
-        if not response:
+        if not response.text:
             return {}
         data = json.loads(response.text)
         if not data:
@@ -42,3 +134,16 @@ def post_request_to_api(url: str, payload: Dict[str, Any], headers: Dict[str, st
 
     except (requests.exceptions.RequestException, LookupError) as err:
         logger.error(err)
+
+
+def is_url_available(url: str, timeout: float = 5) -> bool:
+    """
+    Makes a HEAD request to the link. Returns True if the link leads to an image
+    """
+    try:
+        with span('api.head', endpoint=url.split('?')[0].rsplit('/', 1)[-1]):
+            response = send_request('HEAD', url, timeout=timeout)
+        return response.status_code == 200 and response.content_type.startswith('image/')
+    except (requests.exceptions.RequestException, LookupError) as err:
+        logger.error(err)
+        return False
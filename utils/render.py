@@ -0,0 +1,51 @@
+from loader import db
+from utils.cache import cards_cache, history_cache
+from utils.rapidapi.get_hotels import Hotel, KM_PER_MILE
+
+
+def render_hotel_card(hotel: Hotel, nights: int) -> str:
+    """
+    Returns the HTML card of the hotel. The cards are cached by the hotel (id, price, distance) and the number of nights
+    """
+    key = (hotel, nights)
+    card = cards_cache.get(key)
+    if card is None:
+        card = f'🏨 <b>{hotel.name}</b>\n📍 <b>Адрес:</b>  {hotel.address}\n' \
+               f'📏 <b>Расстояние до центра:</b>  {round(hotel.center * KM_PER_MILE)} км\n' \
+               f'💲 <b>Цена за ночь:</b>  {round(hotel.price)} $' \
+               f'\n💰 <b>Cтоимость за {nights} ноч.:' \
+               f'</b>  {round(nights * hotel.price)} $\n' \
+               f'🔗 <b>Ссылка:</b>  https://www.hotels.com/h{hotel.hotel_id}.Hotel-Information'
+        cards_cache.set(key, card)
+    return card
+
+
+def render_request_info(request_id: str) -> str:
+    """
+    Returns the HTML page with the hotels of the request from the history (empty if there are no hotels).
+    The pages are cached by the request id until the request is deleted.
+    """
+    text = history_cache.get(str(request_id))
+    if text is None:
+        text = ''
+        for hotel in db.get_report_hotel(request_id=request_id):
+            name = hotel[5]
+            address = hotel[6]
+            center = round(float(hotel[7]) * KM_PER_MILE)
+            price = round(float(hotel[8]))
+            link = f'https://www.hotels.com/h{hotel[4]}.Hotel-Information'
+            hotel_info = f'🏨 <b>{name}</b>\n' \
+                         f'📍 <b>Адрес:</b>  {address}\n' \
+                         f'📏 <b>Расстояние до центра:</b>  {center} км\n' \
+                         f'💲 <b>Цена за ночь:</b>  {price} $\n' \
+                         f'🔗 <b>Ссылка:</b>  {link}\n\n\n'
+            text += hotel_info
+        history_cache.set(str(request_id), text)
+    return text
+
+
+def invalidate_request_info(request_id: str) -> None:
+    """
+    Removes the history page of the request from the cache
+    """
+    history_cache.pop(str(request_id))
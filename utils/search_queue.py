@@ -0,0 +1,263 @@
+import asyncio
+import contextvars
+import datetime
+import json
+from contextlib import suppress
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from loguru import logger
+
+from data import config
+from keyboards import kb_inline
+from keyboards.kb_inline import get_kb_inline_hotels_list
+from loader import db, dp
+from utils.accounting import api_user, apply_budget, estimate_api_calls, get_remaining_budget
+from utils.cancellation import CancelToken, SearchCancelled
+from states.states import SearchHotels
+from utils.messages import edit_or_send
+from utils.rapidapi.get_hotels import Hotel, get_hotels_list
+from utils.render import invalidate_request_info
+from utils.tracing import trace
+
+"""
+Queue of hotel searches. The search handler only saves the search parameters to the SearchJob table and answers
+the user, a fixed pool of workers takes the searches from the table in order, runs get_hotels_list in a worker thread
+and edits the progress message in the chat. The searches interrupted by a bot stop are queued again on the start.
+A search is cancelled when the user stops it or starts a new one and is cut short by the deadline.
+The searches of different users are taken by weighted fair queuing, the API calls of a search are counted for its user.
+The result is put into the FSM storage of the user if the user is still waiting for it.
+"""
+
+DATE_FIELDS = ('check_in', 'check_out')
+DATETIME_FIELDS = ('time_request',)
+SKIPPED_FIELDS = ('hotels_list', 'page')
+
+
+class SearchJob(NamedTuple):
+    id: int
+    user_id: int
+    chat_id: int
+    request_id: int
+    message_id: Optional[int]
+    data: str
+
+
+def dump_search_data(data: Dict[str, Any]) -> str:
+    """
+    Returns the search parameters from the FSM storage as JSON
+    """
+    return json.dumps({key: value for key, value in data.items() if key not in SKIPPED_FIELDS},
+                      ensure_ascii=False, default=str)
+
+
+def load_search_data(text: str) -> Dict[str, Any]:
+    """
+    Returns the search parameters saved by dump_search_data
+    """
+    data = json.loads(text)
+    for key in DATE_FIELDS:
+        if data.get(key) is not None:
+            data[key] = datetime.date.fromisoformat(data[key])
+    for key in DATETIME_FIELDS:
+        if data.get(key) is not None:
+            data[key] = datetime.datetime.fromisoformat(data[key])
+    return data
+
+
+class SearchQueue:
+    """
+    Pool of workers running the hotel searches from the SearchJob table
+    Args:
+        workers (int): the number of searches running at once
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.wakeup: Optional[asyncio.Event] = None
+        self.tasks: List[asyncio.Task] = []
+        self.running: Dict[int, Tuple[SearchJob, CancelToken]] = {}
+        self.virtual_time = 0.0
+        self.finish_tags: Dict[int, float] = {}
+
+    def start(self) -> None:
+        """
+        Returns the searches interrupted by the bot stop to the queue and starts the workers
+        """
+        amount = db.requeue_search_jobs()
+        if amount:
+            logger.info(f'Search queue: {amount} interrupted searches are resumed')
+        self.wakeup = asyncio.Event()
+        self.tasks = [asyncio.create_task(self.work(number)) for number in range(self.workers)]
+
+    def enqueue(self, user_id: int, chat_id: int, request_id: int, message_id: int, data: Dict[str, Any]) -> int:
+        """
+        Puts the search into the queue. Returns the job id
+        """
+        job_id = db.add_search_job(user_id=user_id, chat_id=chat_id, request_id=request_id, message_id=message_id,
+                                   data=dump_search_data(data), date_create=str(datetime.datetime.now()))
+        logger.info(f'Search queue: job {job_id} of user {user_id} is queued')
+        if self.wakeup is not None:
+            self.wakeup.set()
+        return job_id
+
+    def pick(self) -> Optional[int]:
+        """
+        Returns the id of the next search by weighted fair queuing across the users. The oldest search of every user
+        gets the finish tag max(virtual time, the last finish tag of the user) + expected API calls / weight,
+        the search with the smallest tag goes first. The users who have spent their daily API budget get
+        the weight config.SEARCH_OVER_BUDGET_WEIGHT.
+        """
+        heads: Dict[int, Tuple[int, str]] = {}
+        for job_id, user_id, data in db.get_queued_searches():
+            heads.setdefault(user_id, (job_id, data))
+        best = None
+        for user_id, (job_id, data) in heads.items():
+            remaining = get_remaining_budget(user_id)
+            weight = config.SEARCH_OVER_BUDGET_WEIGHT if remaining is not None and remaining <= 0 else 1.0
+            start = max(self.virtual_time, self.finish_tags.get(user_id, 0.0))
+            finish = start + estimate_api_calls(load_search_data(data)) / weight
+            if best is None or (finish, job_id) < (best[0], best[1]):
+                best = (finish, job_id, user_id, start)
+        if best is None:
+            return None
+        finish, job_id, user_id, start = best
+        self.virtual_time = start
+        self.finish_tags = {user: tag for user, tag in self.finish_tags.items() if tag > start}
+        self.finish_tags[user_id] = finish
+        return job_id
+
+    async def work(self, number: int) -> None:
+        """
+        Takes the searches from the queue one by one. A queue error (for example, a locked database)
+        is logged and the worker tries again after config.SEARCH_RETRY_PAUSE seconds.
+        """
+        while True:
+            try:
+                job_id = self.pick()
+                row = None
+                if job_id is not None:
+                    row = db.claim_search_job(job_id=job_id, date_update=str(datetime.datetime.now()))
+                if row is None:
+                    self.wakeup.clear()
+                    with suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(self.wakeup.wait(), timeout=config.SEARCH_POLL_INTERVAL)
+                    continue
+                job = SearchJob(*row)
+                logger.info(f'Search worker {number}: job {job.id} of user {job.user_id} is started')
+                try:
+                    status = await self.run(job)
+                except SearchCancelled:
+                    logger.info(f'Search worker {number}: job {job.id} is cancelled')
+                    status = 'cancelled'
+                    await self.notify(job, 'Поиск отменён 🙅')
+                except Exception:
+                    logger.exception(f'Search worker {number}: job {job.id} failed')
+                    status = 'failed'
+                    await self.notify(job, '😞 Не получилось выполнить поиск. Попробуйте ещё раз!'
+                                           '\n\n/lowprice\n\n/bestdeal\n\n/mycity')
+                db.update_search_job(job.id, status=status, date_update=str(datetime.datetime.now()))
+            except Exception:
+                logger.exception(f'Search worker {number}: the queue is not available')
+                await asyncio.sleep(config.SEARCH_RETRY_PAUSE)
+
+    def cancel(self, chat_id: int) -> int:
+        """
+        Cancels the queued and running searches of the chat. Returns the number of the cancelled searches
+        """
+        amount = db.cancel_search_jobs(chat_id=chat_id, date_update=str(datetime.datetime.now()))
+        for job, token in list(self.running.values()):
+            if job.chat_id == chat_id:
+                token.cancel()
+                amount += 1
+        if amount:
+            logger.info(f'Search queue: {amount} searches of chat {chat_id} are cancelled')
+        return amount
+
+    async def run(self, job: SearchJob) -> str:
+        """
+        Runs the search and delivers the result to the user. Returns the status of the job.
+        The search is stopped by cancel() and returns the hotels found so far after config.SEARCH_DEADLINE seconds.
+        """
+        data, degraded = apply_budget(job.user_id, load_search_data(job.data))
+        loop = asyncio.get_running_loop()
+        token = CancelToken(timeout=config.SEARCH_DEADLINE)
+
+        def report(text: str) -> None:
+            if not token.cancelled:
+                asyncio.create_task(edit_or_send(job.chat_id, job.message_id, text,
+                                                 reply_markup=kb_inline.get_kb_inline_delete_stop()))
+
+        def progress(number: int, amount: int) -> None:
+            loop.call_soon_threadsafe(contextvars.copy_context().run, report,
+                                      f'Пожалуйста, подождите! Ищу варианты ... {number}/{amount}')
+
+        with trace('search', user_id=job.user_id):
+            await edit_or_send(job.chat_id, job.message_id, 'Пожалуйста, подождите! Ищу варианты ...',
+                               reply_markup=kb_inline.get_kb_inline_delete_stop())
+            self.running[job.id] = (job, token)
+            reset_user = api_user.set(job.user_id)
+            try:
+                hotels_list = await token.run(get_hotels_list, data, progress)
+            finally:
+                api_user.reset(reset_user)
+                del self.running[job.id]
+            token.check()
+            logger.info('Ready list of hotels')
+            for hotel in hotels_list:
+                db.add_hotel_report(user_id=job.user_id, request_id=job.request_id,
+                                    date_report=datetime.datetime.now(), hotel_id=hotel.hotel_id, name=hotel.name,
+                                    address=hotel.address, center=hotel.center, price=hotel.price,
+                                    photos=hotel.photos)
+            invalidate_request_info(job.request_id)
+            await self.deliver(job, data, hotels_list, partial=token.expired(), degraded=degraded)
+        return 'done'
+
+    @staticmethod
+    async def deliver(job: SearchJob, data: Dict[str, Any], hotels_list: List[Hotel], partial: bool = False,
+                      degraded: bool = False) -> None:
+        """
+        Shows the found hotels. The list is put into the FSM storage only if the user has not started another dialog,
+        otherwise the user is referred to the history of requests. A partial list (the deadline has passed)
+        and a list degraded by the daily API budget are marked.
+        """
+        title = 'Варианты отелей:'
+        if partial and len(hotels_list) < data.get('amount_hotels', 0):
+            title = 'Поиск занял слишком много времени, вот что удалось найти.\nВарианты отелей:'
+        if degraded:
+            title = 'Дневной лимит запросов почти исчерпан, поэтому поиск выполнен в упрощённом режиме ' \
+                    f'(без фотографий, отелей: {data.get("amount_hotels")}).\n{title}'
+        state = dp.current_state(chat=job.chat_id, user=job.user_id)
+        current_state = await state.get_state()
+        current_data = await state.get_data()
+        is_waiting = current_state in (None, SearchHotels.search.state) and \
+            current_data.get('time_request') in (None, data.get('time_request'))
+        if hotels_list and is_waiting:
+            await state.set_state(SearchHotels.search)
+            await state.set_data({**data, 'hotels_list': hotels_list, 'page': 0})
+            await edit_or_send(job.chat_id, job.message_id, title,
+                               reply_markup=await get_kb_inline_hotels_list(state=state, page_shift=0))
+        elif hotels_list:
+            await edit_or_send(job.chat_id, job.message_id,
+                               f'Поиск завершён, найдено отелей: {len(hotels_list)}.\n'
+                               f'Их можно посмотреть в истории запросов:\n\n/history',
+                               reply_markup=kb_inline.get_kb_inline_delete())
+        else:
+            await edit_or_send(job.chat_id, job.message_id,
+                               'К сожалению ничего не могу найти для вас 😞\n'
+                               'Можно попробовать ещё раз, изменив критерии поиска!'
+                               '\n\n/lowprice\n\n/bestdeal\n\n/mycity',
+                               reply_markup=kb_inline.get_kb_inline_delete())
+            logger.info('Hotels are not found')
+            if is_waiting and current_state is not None:
+                await state.finish()
+
+    @staticmethod
+    @logger.catch
+    async def notify(job: SearchJob, text: str) -> None:
+        """
+        Replaces the progress message of the search with the text
+        """
+        await edit_or_send(job.chat_id, job.message_id, text, reply_markup=kb_inline.get_kb_inline_delete())
+
+
+search_queue = SearchQueue(workers=config.SEARCH_WORKERS)
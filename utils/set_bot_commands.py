@@ -11,6 +11,7 @@ async def set_bot_commands(dp) -> None:
         'bestdeal': 'По цене и расстоянию до центра',
         'mycity': 'В моём городе',
         'history': 'История поиска',
+        'export': 'Выгрузить историю файлом',
         'help': 'Справка',
         'hello_world': 'Поздороваться с ботом'
     }
@@ -0,0 +1,108 @@
+import json
+import mmap
+import os
+import pickle
+import struct
+import time
+from typing import Any, Callable, Dict, Tuple
+
+from loguru import logger
+
+from data import config
+from loader import storage
+from utils.cache import caches
+
+"""
+Snapshot of the in-memory state for a warm restart. On the bot stop the caches and the FSM storage are written to
+one file: the header (magic, format version, creation time, index length), the JSON index of the sections
+(name -> offset, length) and the pickled sections. On the start the file is memory-mapped, the header is checked
+and the FSM storage is restored at once, while every cache gets its section only on its first use.
+"""
+
+MAGIC = b'HTBSNAP\n'
+VERSION = 1
+HEADER = struct.Struct('<8sHdI')
+
+
+def save_snapshot(path: str) -> None:
+    """
+    Writes the caches and the FSM storage to the snapshot file (through a temporary file)
+    """
+    started = time.monotonic()
+    try:
+        sections = {f'cache.{cache.name}': pickle.dumps(cache.dump(), protocol=pickle.HIGHEST_PROTOCOL)
+                    for cache in caches}
+        sections['fsm'] = pickle.dumps(storage.data, protocol=pickle.HIGHEST_PROTOCOL)
+        index = {}
+        offset = 0
+        for name, section in sections.items():
+            index[name] = (offset, len(section))
+            offset += len(section)
+        index_bytes = json.dumps(index).encode()
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, VERSION, time.time(), len(index_bytes)))
+            file.write(index_bytes)
+            for section in sections.values():
+                file.write(section)
+        os.replace(temp_path, path)
+    except (OSError, pickle.PicklingError, TypeError, AttributeError) as err:
+        logger.error(f'Snapshot is not saved: {err}')
+        return
+    logger.info(f'Snapshot saved: {offset / 1024:.0f} KB in {time.monotonic() - started:.2f} s')
+
+
+def open_snapshot(path: str) -> Tuple[mmap.mmap, Dict[str, Tuple[int, int]], int]:
+    """
+    Memory-maps the snapshot file and checks its header. Returns the map, the index of the sections
+    and the offset of the first section
+    """
+    with open(path, 'rb') as file:
+        snapshot = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, version, created, index_length = HEADER.unpack_from(snapshot, 0)
+    except struct.error:
+        snapshot.close()
+        raise ValueError('Broken snapshot header')
+    if magic != MAGIC or version != VERSION:
+        snapshot.close()
+        raise ValueError(f'Unsupported snapshot version {version}')
+    if time.time() - created > config.SNAPSHOT_MAX_AGE:
+        snapshot.close()
+        raise ValueError(f'Snapshot is too old ({time.time() - created:.0f} s)')
+    start = HEADER.size + index_length
+    index = json.loads(snapshot[HEADER.size:start])
+    return snapshot, index, start
+
+
+def get_section_loader(snapshot: mmap.mmap, name: str, offset: int, length: int) -> Callable[[], Any]:
+    """
+    Returns the function unpickling the section of the snapshot (an empty list if the section is broken)
+    """
+    def load() -> Any:
+        try:
+            return pickle.loads(snapshot[offset:offset + length])
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, ValueError) as err:
+            logger.warning(f'Snapshot section {name} is skipped: {err}')
+            return []
+    return load
+
+
+def restore_snapshot(path: str) -> None:
+    """
+    Restores the FSM storage from the snapshot file and defers loading of the caches until their first use.
+    A missing, broken or incompatible snapshot is skipped.
+    """
+    if not os.path.exists(path):
+        return
+    try:
+        snapshot, index, start = open_snapshot(path)
+        storage.data.update(get_section_loader(snapshot, 'fsm', start + index['fsm'][0], index['fsm'][1])())
+    except (OSError, ValueError, KeyError) as err:
+        logger.warning(f'Snapshot is skipped: {err}')
+        return
+    for cache in caches:
+        section = index.get(f'cache.{cache.name}')
+        if section is not None:
+            cache.defer(get_section_loader(snapshot, cache.name, start + section[0], section[1]))
+    logger.info(f'Snapshot restored: {len(storage.data)} chats, sections: {", ".join(index)}')
@@ -0,0 +1,173 @@
+import json
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, NamedTuple, Optional
+
+from aiogram import Bot
+from loguru import logger
+
+from data import config
+
+
+class Span(NamedTuple):
+    span_id: int
+    parent_id: Optional[int]
+    name: str
+    start: float
+    duration: float
+    attrs: Dict[str, Any]
+
+
+class Trace:
+    """
+    Spans of one search: API calls, SQL statements and Bot API calls
+    Args:
+        name (str): the trace name
+        user_id (int): the user who started the search
+    """
+
+    def __init__(self, name: str, user_id: int):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.user_id = user_id
+        self.started = time.time()
+        self.duration = 0.0
+        self.spans: List[Span] = []
+        self._next_span_id = 0
+
+    def new_span_id(self) -> int:
+        """
+        Returns the next span id inside the trace
+        """
+        self._next_span_id += 1
+        return self._next_span_id
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the trace in the form of a dict for export
+        """
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'user_id': self.user_id,
+            'started': self.started,
+            'duration': self.duration,
+            'spans': [span._asdict() for span in self.spans],
+        }
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar('current_trace', default=None)
+current_span: ContextVar[Optional[int]] = ContextVar('current_span', default=None)
+last_traces: Dict[int, Trace] = {}
+latencies: Dict[str, Deque[float]] = {}
+
+
+def record_latency(name: str, duration: float) -> None:
+    """
+    Saves the duration among the last config.LATENCY_WINDOW durations of the kind (a trace name or a span category)
+    """
+    window = latencies.get(name)
+    if window is None:
+        window = latencies.setdefault(name, deque(maxlen=config.LATENCY_WINDOW))
+    window.append(duration)
+
+
+def get_percentiles(name: str, percents: tuple = (50, 90, 99)) -> Optional[List[float]]:
+    """
+    Returns the percentiles of the last durations of the kind (None if there are no durations)
+    """
+    durations = sorted(latencies.get(name, ()))
+    if not durations:
+        return None
+    return [durations[min(len(durations) - 1, len(durations) * percent // 100)] for percent in percents]
+
+
+@contextmanager
+def trace(name: str, user_id: int) -> Iterator[Trace]:
+    """
+    Starts a trace for the current context. On exit the trace is saved as the last trace of the user
+    and exported to the trace file.
+    """
+    new_trace = Trace(name=name, user_id=user_id)
+    trace_token = current_trace.set(new_trace)
+    span_token = current_span.set(None)
+    start = time.perf_counter()
+    try:
+        yield new_trace
+    finally:
+        new_trace.duration = time.perf_counter() - start
+        current_span.reset(span_token)
+        current_trace.reset(trace_token)
+        last_traces[user_id] = new_trace
+        record_latency(name, new_trace.duration)
+        export_trace(new_trace)
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[None]:
+    """
+    Measures a child span of the current trace. Does nothing outside a trace.
+    """
+    active_trace = current_trace.get()
+    if active_trace is None:
+        yield
+        return
+    span_id = active_trace.new_span_id()
+    parent_id = current_span.get()
+    token = current_span.set(span_id)
+    started = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        current_span.reset(token)
+        record_latency(name.split('.')[0], duration)
+        active_trace.spans.append(Span(span_id=span_id, parent_id=parent_id, name=name, start=started,
+                                       duration=duration, attrs=attrs))
+
+
+def export_trace(finished_trace: Trace) -> None:
+    """
+    Appends the trace to the JSON lines file
+    """
+    try:
+        with open(config.TRACE_FILE, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(finished_trace.to_dict(), ensure_ascii=False, default=str) + '\n')
+    except OSError as err:
+        logger.error(err)
+
+
+def get_breakdown(finished_trace: Trace) -> str:
+    """
+    Returns the text report: time spent on each kind of span and the slowest spans
+    """
+    groups: Dict[str, List[float]] = {}
+    for item in finished_trace.spans:
+        category = item.name.split('.')[0]
+        groups.setdefault(category, []).append(item.duration)
+    lines = [f'trace {finished_trace.trace_id}',
+             f'{finished_trace.name}, user {finished_trace.user_id}, '
+             f'{time.strftime("%d.%m.%y %H:%M:%S", time.localtime(finished_trace.started))}',
+             f'total: {finished_trace.duration * 1000:.0f} ms', '']
+    for category, durations in sorted(groups.items(), key=lambda group: -sum(group[1])):
+        lines.append(f'{category:<6} {len(durations):>4} calls {sum(durations) * 1000:>9.0f} ms')
+    lines.append('')
+    lines.append('slowest:')
+    for item in sorted(finished_trace.spans, key=lambda i_span: -i_span.duration)[:10]:
+        attrs = ' '.join(f'{key}={value}' for key, value in item.attrs.items())
+        lines.append(f'{item.duration * 1000:>7.0f} ms {item.name} {attrs}'.rstrip())
+    return '\n'.join(lines)
+
+
+class TracedBot(Bot):
+    """
+    Bot whose Bot API calls are recorded as spans of the current trace
+    """
+
+    async def request(self, method: str, data: Optional[Dict] = None, files: Optional[Dict] = None, **kwargs):
+        with span(f'bot.{method}'):
+            return await super().request(method, data, files, **kwargs)
@@ -0,0 +1,57 @@
+import asyncio
+import datetime
+
+from loguru import logger
+
+from data import config
+from loader import db
+from utils.cache import location_cache, hotels_cache
+from utils.rapidapi.get_cities import get_city_info
+from utils.rapidapi.get_hotels import get_hotels_info, get_hotels_payload, get_hotels_cache_key, predict_page_size
+
+
+@logger.catch
+async def warm_up_caches() -> None:
+    """
+    Fills the location and hotel list caches with the most frequent searches of the last config.WARMUP_DAYS days.
+    Works in the background: API requests are made one by one in a worker thread with a pause between them
+    and no more than config.WARMUP_API_BUDGET requests in total. The hotel lists are requested with the page size
+    a real search of the area and the distance window would ask for.
+    """
+    date_from = str(datetime.datetime.now() - datetime.timedelta(days=config.WARMUP_DAYS))
+    budget = config.WARMUP_API_BUDGET
+    cities = db.get_popular_cities(date_from=date_from, limit=config.WARMUP_TOP_N)
+    searches = db.get_popular_searches(date_from=date_from, check_in_from=str(datetime.date.today()),
+                                       limit=config.WARMUP_TOP_N)
+    logger.info(f'Cache warmup: {len(cities)} cities, {len(searches)} searches, budget {budget}')
+
+    for city, _ in cities:
+        if budget <= 0:
+            break
+        if city.strip().lower() in location_cache:
+            continue
+        await asyncio.sleep(config.WARMUP_PAUSE)
+        await asyncio.to_thread(get_city_info, city)
+        budget -= 1
+
+    for command, area_id, amount_hotels, check_in, check_out, price_min, price_max, center_max, _ in searches:
+        if budget <= 0:
+            break
+        data = {
+            'command': command,
+            'area_id': str(area_id),
+            'amount_hotels': amount_hotels,
+            'check_in': check_in,
+            'check_out': check_out,
+            'price_min': price_min,
+            'price_max': price_max,
+            'center_max': center_max,
+        }
+        if command != 'самые дешёвые':
+            data['page_size'] = predict_page_size(data)
+        if get_hotels_cache_key(get_hotels_payload(data)) in hotels_cache:
+            continue
+        await asyncio.sleep(config.WARMUP_PAUSE)
+        await asyncio.to_thread(get_hotels_info, data)
+        budget -= 1
+    logger.info(f'Cache warmup finished, API budget left {budget}')
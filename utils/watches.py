@@ -0,0 +1,158 @@
+import asyncio
+import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from aiogram.utils.exceptions import TelegramAPIError
+from loguru import logger
+
+from data import config
+from keyboards import kb_inline
+from loader import bot, db
+from utils.geo import decode_geohash, encode_geohash
+from utils.outbound import low_priority
+from utils.rapidapi.get_hotels import PropertyBatch, get_hotels_cache_key, get_hotels_info, get_hotels_payload, \
+    parse_hotel_id, parse_hotel_name
+
+"""
+Price watches of the saved searches. The sweeper takes the watched requests whose check-in date has not passed and
+groups them by the hotel list request they need (region or geohash tile, dates, sort, price filter), so every group
+costs one properties/v2/list call. The groups are checked one by one evenly over config.WATCH_INTERVAL seconds,
+no more than config.WATCH_API_BUDGET groups per sweep. The lowest price is found for every watch of the group inside
+its own windows, and only the users whose price threshold was crossed are notified.
+"""
+
+MY_CITY = 'в моём городе с учётом цены и расположения от центра'
+LOW_PRICE = 'самые дешёвые'
+
+
+class Watch(NamedTuple):
+    id: int
+    user_id: int
+    request_id: int
+    price_threshold: Optional[float]
+    data: Dict[str, Any]
+
+
+def get_watch_groups() -> List[Tuple[Dict[str, Any], List[Watch]]]:
+    """
+    Returns the watches due for a check (not checked for config.WATCH_INTERVAL seconds) grouped by the hotel list
+    request: (the parameters of the request, the watches)
+    """
+    groups: Dict[str, Tuple[Dict[str, Any], List[Watch]]] = {}
+    checked_before = str(datetime.datetime.now() - datetime.timedelta(seconds=config.WATCH_INTERVAL))
+    for row in db.get_active_watches(check_in_from=str(datetime.date.today()), checked_before=checked_before):
+        watch_id, user_id, request_id, price_threshold, command, area_id, area_name, latitude, longitude, \
+            check_in, check_out, price_min, price_max, center_min, center_max = row
+        data = {
+            'command': command,
+            'area_id': str(area_id),
+            'area_name': area_name,
+            'lat': latitude,
+            'lon': longitude,
+            'amount_hotels': config.WATCH_RESULTS_SIZE,
+            'check_in': check_in,
+            'check_out': check_out,
+            'price_min': price_min,
+            'price_max': price_max,
+            'center_min': center_min,
+            'center_max': center_max,
+        }
+        group_data = data
+        if command == MY_CITY:
+            tile_latitude, tile_longitude = decode_geohash(encode_geohash(latitude, longitude,
+                                                                          config.GEO_TILE_PRECISION))
+            group_data = {**data, 'lat': tile_latitude, 'lon': tile_longitude}
+        key = get_hotels_cache_key(get_hotels_payload(group_data))
+        groups.setdefault(key, (group_data, []))[1].append(
+            Watch(id=watch_id, user_id=user_id, request_id=request_id, price_threshold=price_threshold, data=data))
+    return list(groups.values())
+
+
+def get_lowest_offer(watch: Watch, properties: List[dict]) -> Optional[Tuple[float, dict]]:
+    """
+    Returns the lowest price and the hotel inside the price and center windows of the watch
+    """
+    batch = PropertyBatch(properties)
+    if watch.data['command'] == MY_CITY:
+        batch = batch.localize(watch.data['lat'], watch.data['lon'])
+    if watch.data['command'] != LOW_PRICE:
+        batch = batch.filter_window(price_min=float(watch.data['price_min']), price_max=float(watch.data['price_max']),
+                                    center_min=float(watch.data['center_min']),
+                                    center_max=float(watch.data['center_max']))
+    batch = batch.take(batch.price > 0)
+    if len(batch) == 0:
+        return None
+    row = int(np.argmin(batch.price))
+    return float(batch.price[row]), properties[batch.index[row]]
+
+
+async def notify_price_drop(watch: Watch, price: float, hotel: dict) -> None:
+    """
+    Sends the price drop notice to the user. The notices wait for the interactive replies in the outbound queue
+    """
+    text = f'📉 <b>Цена снизилась!</b>\n' \
+           f'{watch.data["area_name"]}, {watch.data["check_in"]} — {watch.data["check_out"]}\n' \
+           f'🏨 <b>{parse_hotel_name(hotel)}</b>\n' \
+           f'💲 <b>Цена за ночь:</b>  {round(price)} $\n' \
+           f'🔗 <b>Ссылка:</b>  https://www.hotels.com/h{parse_hotel_id(hotel)}.Hotel-Information'
+    with low_priority():
+        try:
+            await bot.send_message(watch.user_id, text, parse_mode='HTML',
+                                   reply_markup=kb_inline.get_kb_inline_delete())
+        except TelegramAPIError as err:
+            logger.error(f'Price watch {watch.id}: {err}')
+
+
+@logger.catch
+async def check_group(data: Dict[str, Any], watches: List[Watch]) -> int:
+    """
+    Makes one hotel list request for the group and notifies the users whose threshold was crossed.
+    The threshold of a notified watch moves config.WATCH_PRICE_DROP percent below the new price.
+    Returns the number of notices.
+    """
+    hotels_result_api = await asyncio.to_thread(get_hotels_info, data)
+    if hotels_result_api is None or hotels_result_api.get('data') is None:
+        return 0
+    properties = hotels_result_api.get('data', {}).get('propertySearch', {}).get('properties', None) or []
+    notices = 0
+    for watch in watches:
+        threshold = watch.price_threshold
+        offer = get_lowest_offer(watch, properties)
+        if offer is not None and (threshold is None or offer[0] < threshold):
+            await notify_price_drop(watch, *offer)
+            threshold = offer[0] * (1 - config.WATCH_PRICE_DROP / 100)
+            notices += 1
+        db.update_watch(watch.id, price_threshold=threshold, date_check=str(datetime.datetime.now()))
+    return notices
+
+
+def get_next_sweep_delay() -> float:
+    """
+    Returns the number of seconds until the next watch is due for a check
+    """
+    date_check = db.get_next_watch_check(check_in_from=str(datetime.date.today()))
+    if date_check is None:
+        return config.WATCH_INTERVAL
+    due = datetime.datetime.fromisoformat(date_check) + datetime.timedelta(seconds=config.WATCH_INTERVAL)
+    return min(max((due - datetime.datetime.now()).total_seconds(), 60), config.WATCH_INTERVAL)
+
+
+@logger.catch
+async def run_watches() -> None:
+    """
+    Checks the price watches in sweeps of config.WATCH_INTERVAL seconds. Only the watches not checked for
+    config.WATCH_INTERVAL seconds are taken, so a restart does not check them again.
+    """
+    while True:
+        groups = get_watch_groups()[:config.WATCH_API_BUDGET]
+        logger.info(f'Price watches: {len(groups)} groups, {sum(len(watches) for _, watches in groups)} watches')
+        if not groups:
+            await asyncio.sleep(get_next_sweep_delay())
+            continue
+        pause = config.WATCH_INTERVAL / len(groups)
+        for data, watches in groups:
+            notices = await check_group(data, watches)
+            if notices:
+                logger.info(f'Price watches: {notices} of {len(watches)} users are notified')
+            await asyncio.sleep(pause)